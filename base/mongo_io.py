@@ -1,32 +1,129 @@
+import atexit
+import logging
+import os
+import threading
+
+import pandas as pd
 from funcy import merge
-from pymongo import MongoClient
+from pymongo import DESCENDING, MongoClient
+from pymongo.errors import PyMongoError
 
 import settings
 
+_clients = dict()
+_clients_pid = None
+_clients_lock = threading.Lock()
+_indexed = set()
+
+
+def get_client(host=None, port=None):
+    """Process-wide client for (host, port), created again after a fork."""
+    global _clients_pid
+    host = host or settings.MONGO_DEFAULT['host']
+    port = port or settings.MONGO_DEFAULT['port']
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        if (host, port) not in _clients:
+            _clients[(host, port)] = MongoClient(host=host, port=port, connect=False,
+                                                 maxPoolSize=settings.MONGO_MAX_POOL_SIZE)
+        return _clients[(host, port)]
+
+
+def close_clients():
+    with _clients_lock:
+        if _clients_pid == os.getpid():
+            for client in _clients.values():
+                client.close()
+        _clients.clear()
+
+
+atexit.register(close_clients)
+
+
+def ensure_indexes(db, collections=None, indexes=None):
+    """Create the indexes declared in settings.MONGO_INDEXES, once per process and collection."""
+    indexes = settings.MONGO_INDEXES if indexes is None else indexes
+    for name in (collections or indexes.keys()):
+        key = (id(db.client), db.name, name)
+        if not indexes.get(name) or key in _indexed:
+            continue
+        # Attempted only once per process, so that an unreachable server does not stall every new MongoIO
+        _indexed.add(key)
+        try:
+            for keys in indexes[name]:
+                db[name].create_index(keys, background=True)
+        except PyMongoError as e:
+            logging.warning("Failed to create the indexes of %s.%s: %s", db.name, name, e)
+    return db
+
 
 class MongoIO(object):
     def __init__(self, **kwargs):
         options = merge(settings.MONGO_DEFAULT, kwargs)
-        self.client = MongoClient(host=options['host'], port=options['port'], connect=False)
+        self.client = get_client(options['host'], options['port'])
         self.db = self.client[options['db']]
         self.collection = self.db[options['collection']]
+        ensure_indexes(self.db, [options['collection']])
 
     def save(self, doc):
         return self.collection.insert_one(doc).inserted_id
 
+    def bulk_write(self, requests, ordered=False):
+        return self.collection.bulk_write(requests, ordered=ordered)
+
     def remove(self, id):
         return self.collection.remove(id)
 
-    def load(self, return_cursor=False, criteria=None, projection=None):
-        if criteria is None:
-            criteria = {}
-        if projection is None:
-            cursor = self.collection.find(criteria)
-        else:
-            cursor = self.collection.find(criteria, projection)
+    def find(self, criteria=None, projection=None, sort=None, limit=0, batch_size=0):
+        cursor = self.collection.find(criteria or {}, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        return cursor
+
+    def load(self, return_cursor=False, criteria=None, projection=None, sort=None, limit=0):
+        cursor = self.find(criteria, projection, sort=sort, limit=limit)
 
         # Return a cursor for large amounts of data
         if return_cursor:
             return cursor
         else:
             return [item for item in cursor]
+
+    def load_batches(self, criteria=None, projection=None, sort=None, limit=0, batch_size=None):
+        batch_size = batch_size or settings.MONGO_CHUNK_SIZE
+        batch = []
+        for item in self.find(criteria, projection, sort=sort, limit=limit, batch_size=batch_size):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def load_dataframes(self, criteria=None, projection=None, sort=None, limit=0, batch_size=None):
+        columns = None
+        if projection:
+            # find also accepts a list of the fields to include
+            if not isinstance(projection, dict):
+                projection = dict.fromkeys(projection, True)
+            columns = [k for k, v in projection.iteritems() if v] or None
+        for batch in self.load_batches(criteria, projection, sort=sort, limit=limit, batch_size=batch_size):
+            yield pd.DataFrame.from_records(batch, columns=columns)
+
+    def load_dataframe(self, criteria=None, projection=None, sort=None, limit=0, batch_size=None):
+        frames = list(self.load_dataframes(criteria, projection, sort=sort, limit=limit, batch_size=batch_size))
+        if not frames:
+            return pd.DataFrame([])
+        return pd.concat(frames, ignore_index=True)
+
+    def load_latest(self, criteria=None, projection=None, sort_key='update_time'):
+        """The last document according to `sort_key`, by default the last one saved by DataSaver."""
+        for item in self.find(criteria, projection, sort=[(sort_key, DESCENDING)], limit=1):
+            return item
+        return None
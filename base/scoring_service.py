@@ -0,0 +1,151 @@
+import json
+import logging
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from Queue import Empty, Queue
+from SocketServer import ThreadingMixIn
+
+import numpy as np
+
+
+class FlatFeatures(object):
+    """Adapt a classifier trained on flattened trials (e.g. a BaseClassifier) to (n, channels, samples, comps) input."""
+
+    def __init__(self, model, trial_shape=None):
+        self.model = model
+        self.trial_shape = trial_shape
+
+    @property
+    def classes(self):
+        return self.model.classes
+
+    def predict_proba(self, samples):
+        return self.model.predict_proba(samples.reshape((len(samples), -1)))
+
+
+class MicroBatcher(object):
+    """Merge the concurrent calls to a model into single `predict_proba` calls, all made from one thread."""
+
+    def __init__(self, model, max_batch_size=256, max_delay=0.005):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.trial_shape = getattr(model, 'trial_shape', None)
+        self._queue = Queue()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def classes(self):
+        return self.model.classes
+
+    def check(self, samples):
+        if samples.ndim != 4 or not len(samples):
+            raise ValueError("Expecting a non-empty list of (channels, samples, comps) trials but got shape %s"
+                             % (samples.shape, ))
+        if self.trial_shape is not None and samples.shape[1:] != tuple(self.trial_shape):
+            raise ValueError("Expecting trials of shape %s but got %s" % (tuple(self.trial_shape), samples.shape[1:]))
+        return samples
+
+    def predict_proba(self, samples):
+        request = {'samples': self.check(np.asarray(samples, dtype=np.float32)), 'done': threading.Event()}
+        self._queue.put(request)
+        request['done'].wait()
+        if 'error' in request:
+            raise request['error']
+        return request['probabilities'], request['batch_size']
+
+    def _collect(self):
+        requests = [self._queue.get()]
+        n_samples = len(requests[0]['samples'])
+        deadline = time.time() + self.max_delay
+        while n_samples < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except Empty:
+                break
+            requests.append(request)
+            n_samples += len(request['samples'])
+        return requests, n_samples
+
+    def _score(self, requests, n_samples):
+        probabilities = self.model.predict_proba(np.concatenate([r['samples'] for r in requests]))
+        start = 0
+        for request in requests:
+            end = start + len(request['samples'])
+            request['probabilities'] = probabilities[start:end]
+            request['batch_size'] = n_samples
+            start = end
+        if self.trial_shape is None:
+            self.trial_shape = requests[0]['samples'].shape[1:]
+
+    def _run(self):
+        while True:
+            requests, n_samples = self._collect()
+            try:
+                self._score(requests, n_samples)
+            except Exception as e:
+                if len(requests) == 1:
+                    requests[0]['error'] = e
+                else:
+                    # Isolate the failing requests rather than failing the whole batch
+                    for request in requests:
+                        try:
+                            self._score([request], len(request['samples']))
+                        except Exception as e:
+                            request['error'] = e
+            for request in requests:
+                request['done'].set()
+
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    """GET /models lists the models; POST /predict/<model> scores a JSON body {"samples": [trial, ...]}."""
+
+    def _reply(self, code, doc):
+        body = json.dumps(doc)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/models':
+            return self._reply(404, {'error': "Unknown path '%s'" % self.path})
+        self._reply(200, {name: {'classes': np.asarray(model.classes).tolist()}
+                          for name, model in self.server.models.iteritems()})
+
+    def do_POST(self):
+        start = time.time()
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'predict' or parts[1] not in self.server.models:
+            return self._reply(404, {'error': "Unknown path '%s'" % self.path})
+        model = self.server.models[parts[1]]
+        try:
+            samples = np.asarray(json.loads(self.rfile.read(int(self.headers['Content-Length'])))['samples'])
+            probabilities, batch_size = model.predict_proba(samples)
+        except Exception as e:
+            logging.error("Failed to score a request for %s: %s", parts[1], e)
+            return self._reply(400, {'error': str(e)})
+        labels = np.asarray(model.classes)[np.argmax(probabilities, axis=1)]
+        latency = 1e3 * (time.time() - start)
+        logging.info("Scored %s trials with %s in %.2f ms (batch of %s)", len(samples), parts[1], latency, batch_size)
+        self._reply(200, {'model': parts[1], 'labels': labels.tolist(), 'probabilities': probabilities.tolist(),
+                          'batch_size': batch_size, 'latency_ms': latency})
+
+    def log_message(self, fmt, *args):
+        logging.debug(fmt, *args)
+
+
+class ScoringServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, models, host='localhost', port=8500, max_batch_size=256, max_delay=0.005):
+        HTTPServer.__init__(self, (host, port), ScoringRequestHandler)
+        self.models = {name: MicroBatcher(model, max_batch_size=max_batch_size, max_delay=max_delay)
+                       for name, model in models.iteritems()}
@@ -60,6 +60,13 @@ class BaseClassifier(BaseData):
     def predict(self, x):
         return self._pipeline.predict(x)
 
+    def predict_proba(self, x):
+        return self._pipeline.predict_proba(x)
+
+    @property
+    def classes(self):
+        return self._pipeline.classes_
+
     def score(self, x, y):
         y_pred = self.predict(x)
         return dict(accuracy=accuracy_score(y, y_pred), confusion_matrix=confusion_matrix(y, y_pred).tolist(),
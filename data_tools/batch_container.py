@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+import tables
+
+
+class BatchContainerWriter(object):
+    """Write all the batches of a run into a single HDF5 file, read back with one slice per batch."""
+
+    def __init__(self, file_name, complevel=0, expected_batches=1000):
+        self.file_name = file_name
+        self._h5 = tables.open_file(file_name, mode='w')
+        self._filters = tables.Filters(complevel=complevel, complib='blosc') if complevel else None
+        self._expected_batches = expected_batches
+        self._samples = None
+        self._labels = None
+        self._offsets = [0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+        return False
+
+    def _create_array(self, name, arr):
+        return self._h5.create_earray('/', name, atom=tables.Atom.from_dtype(arr.dtype), shape=(0, ) + arr.shape[1:],
+                                      filters=self._filters, chunkshape=(max(len(arr), 1), ) + arr.shape[1:],
+                                      expectedrows=len(arr) * self._expected_batches)
+
+    def append(self, samples, labels):
+        samples = np.asarray(samples)
+        labels = np.asarray(labels)
+        assert len(samples) == len(labels), "Mismatch between number of samples and labels"
+        if self._samples is None:
+            self._samples = self._create_array('samples', samples)
+            self._labels = self._create_array('labels', labels)
+        self._samples.append(samples)
+        self._labels.append(labels)
+        self._offsets.append(self._offsets[-1] + len(samples))
+        return self
+
+    def close(self):
+        if self._h5.isopen:
+            self._h5.create_array('/', 'offsets', np.asarray(self._offsets, dtype=np.int64))
+            self._h5.close()
+        return self
+
+    def discard(self):
+        """Close without the offsets, which mark the file as complete, and remove the file."""
+        if self._h5.isopen:
+            self._h5.close()
+        if os.path.isfile(self.file_name):
+            os.remove(self.file_name)
+        return self
+
+
+class BatchContainer(object):
+    """Random access to the batches of a file written by BatchContainerWriter."""
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._h5 = tables.open_file(file_name, mode='r')
+        self._offsets = self._h5.root.offsets.read()
+        self._samples = self._h5.root.samples
+        self._labels = self._h5.root.labels
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    @property
+    def n_samples(self):
+        return int(self._offsets[-1])
+
+    def batch(self, index, out=None):
+        start, end = self._offsets[index], self._offsets[index + 1]
+        shape = (end - start, ) + self._samples.shape[1:]
+        if out is None or out.shape != shape or out.dtype != self._samples.dtype:
+            samples = self._samples.read(start, end)
+        else:
+            samples = out
+            self._samples.read(start, end, out=samples)
+        return samples, self._labels.read(start, end)
+
+    def close(self):
+        if self._h5.isopen:
+            self._h5.close()
+        return self
@@ -2,17 +2,18 @@ import logging
 import os
 import random
 import sys
-from collections import defaultdict
+from collections import OrderedDict
 
 import deepdish as dd
 import numpy as np
 import pandas as pd
-from brainpy.eeg import EEG
 from sklearn.cross_validation import train_test_split
 
 import settings
 from data_saver import DataSaver
-from matlab_data_reader import matlab_data_reader, get_matlab_labels
+from derivation_cache import read_derived_eeg
+from trial_store import trial_labels
+from .batch_container import BatchContainerWriter
 from .utils import OneHotEncoder
 
 
@@ -41,7 +42,7 @@ class BatchCreator(object):
             "Derivation '%s' is not supported" % eeg_derivation
         random.seed(seed)
         eeg_info = filter(lambda x: x['subject'] == subject, settings.FILE_LIST)[0]
-        labels = get_matlab_labels(eeg_info['filename'])
+        labels = trial_labels(eeg_info['filename'])
         classes = list(set(labels))
         self._info = {'batch_size': batch_size, 'test_proportion': test_proportion, 'outdir': outdir, 'seed': seed,
                       'avg_group_size': avg_group_size, 'eeg_derivation': eeg_derivation.lower(), 'subject': subject,
@@ -51,28 +52,18 @@ class BatchCreator(object):
     def _get_batches(self, max_iter, values_list, file_prefix, file_extension):
         random.seed(self._info['seed'])
         batch_iter = BatchIterator(self._info['batch_size'], values_list)
-        batches = defaultdict(list)
+        # In batch-number order, which is also the order of the batches in a single-file container
+        batches = OrderedDict()
         for n, _ in enumerate(range(0, max_iter, self._info['batch_size'])):
             batch_file = os.path.join(self._info['outdir'], "%s_%s%s" % (file_prefix, n, file_extension))
-            curr_batch = batch_iter.next_batch()
-            for trial_index in curr_batch:
-                batches[batch_file].append(trial_index)
+            batches[batch_file] = list(batch_iter.next_batch())
         return batches
 
-    def create(self, max_iter):
+    def create(self, max_iter, single_file=False):
         logging.info("Processing the EEG file %s", self._info['eeg']['filename'])
-        eeg = EEG(data_reader=matlab_data_reader).read(self._info['eeg']['filename'])
-        if self._info['avg_group_size'] > 1:
-            logging.info("Averaging trials")
-            eeg.average_trials(self._info['avg_group_size'], inplace=True)
-        if self._info['eeg_derivation'] != 'potential':
-            logging.info("Building the %s derivation", self._info['eeg_derivation'])
-            if self._info['eeg_derivation'] == "electric_field":
-                eeg.get_electric_field(inplace=True)
-            elif self._info['eeg_derivation'] == 'laplacian':
-                eeg.get_laplacian(inplace=True)
-            else:
-                raise KeyError("Derivation '%s' is not supported", self._info['eeg_derivation'])
+        logging.info("Building the %s derivation", self._info['eeg_derivation'])
+        eeg = read_derived_eeg(self._info['eeg']['filename'], self._info['eeg_derivation'],
+                               avg_group_size=self._info['avg_group_size'])
         if eeg.data.ndim == 3:
             eeg.data = eeg.data[:, :, :, np.newaxis]
         labels = eeg.trial_labels
@@ -85,33 +76,36 @@ class BatchCreator(object):
         batches_train = self._get_batches(max_iter, idx_train, "%s_train" % self._info['subject'], '.hd5')
         self._info['n_train_batches'] = len(batches_train)
         self._info['files_train'] = batches_train.keys()
-        created_files = defaultdict(dict)
+        # One-hot encodes all the labels at once; each batch file is then written exactly once
+        encoded_labels = self.label_encoder.transform(labels)
         logging.info("Creating the batch files")
-        for batch_file, trial_indices in batches_train.iteritems():
-            encoded_labels = map(lambda x: self.label_encoder.transform(labels[x]), trial_indices)
-            if created_files['train'].get(batch_file):
-                rec = dd.io.load(batch_file)
-                samples = np.r_[rec['samples'], eeg[trial_indices, :, :, :]]
-                labs = rec['labels'].append(encoded_labels)
-            else:
-                samples = eeg[trial_indices, :, :, :]
-                labs = encoded_labels
+        if single_file:
+            train_file = os.path.join(self._info['outdir'], "%s_train_batches.h5" % self._info['subject'])
+            self._info['files_train'] = []
+            self._info['container_train'] = train_file
             try:
-                dd.io.save(batch_file, {'samples': samples, 'labels': labs})
-                if not created_files['train'].get(batch_file):
-                    logging.info("Successfully created the training file %s", batch_file)
-                created_files['train'][batch_file] = True
+                with BatchContainerWriter(train_file, expected_batches=len(batches_train)) as writer:
+                    for trial_indices in batches_train.itervalues():
+                        writer.append(eeg[trial_indices, :, :, :], encoded_labels[trial_indices])
+                logging.info("Successfully created the training file %s", train_file)
             except Exception as e:
-                logging.error("Failed to create the training file %s: %s", batch_file, e)
+                logging.error("Failed to create the training file %s: %s", train_file, e)
                 sys.exit(1)
+        else:
+            for batch_file, trial_indices in batches_train.iteritems():
+                try:
+                    dd.io.save(batch_file, {'samples': eeg[trial_indices, :, :, :],
+                                            'labels': encoded_labels[trial_indices]})
+                    logging.info("Successfully created the training file %s", batch_file)
+                except Exception as e:
+                    logging.error("Failed to create the training file %s: %s", batch_file, e)
+                    sys.exit(1)
         test_file = os.path.join(self._info['outdir'], "%s_test.hd5" % self._info['subject'])
         self._info['n_test_batches'] = 1
         self._info['files_test'] = [test_file]
-        created_files['test'][test_file] = True
         try:
-            dd.io.save(test_file, {'samples': eeg[idx_test, :, :, :],
-                                   'labels': [list(self.label_encoder.transform(x)) for x in labels[idx_test]]})
-            logging.error("Successfully created the test file %s", test_file)
+            dd.io.save(test_file, {'samples': eeg[idx_test, :, :, :], 'labels': encoded_labels[idx_test]})
+            logging.info("Successfully created the test file %s", test_file)
         except Exception as e:
             logging.error("Failed to create the test file %s: %s", test_file, e)
             sys.exit(1)
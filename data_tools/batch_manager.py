@@ -2,6 +2,7 @@ import deepdish as dd
 import numpy as np
 
 import settings
+from .batch_container import BatchContainer
 from .data_loader import DataLoader
 
 
@@ -14,11 +15,14 @@ class BatchManager(object):
         self._doc = dict()
         self._data = dict()
         self._coll = settings.MONGO_DNN_COLLECTION
+        self._container = None
 
     def load(self, db_id):
         self._doc = DataLoader.load(settings.MONGO_DNN_COLLECTION, _id=db_id)
         if self._doc:
             self._doc = self._doc[0]
+            if self._doc.get('container_train'):
+                self._container = BatchContainer(self._doc['container_train'])
         return self
 
     def samples(self, typ):
@@ -44,8 +48,18 @@ class BatchManager(object):
         self._data[typ] = {'samples': data['samples'], 'labels': data['labels']}
         return True
 
+    def _next_from_container(self, typ, curr):
+        if curr >= len(self._container):
+            return False
+        samples, labels = self._container.batch(curr)
+        self._data[typ] = {'samples': samples, 'labels': labels}
+        return True
+
     def next_batch(self):
-        state = self._next('train', self._curr_batch, self.files_train)
+        if self._container is not None:
+            state = self._next_from_container('train', self._curr_batch)
+        else:
+            state = self._next('train', self._curr_batch, self.files_train)
         self._curr_batch += int(state)
         return state
 
@@ -1,69 +1,165 @@
 import glob
 import os
-from collections import defaultdict
+import sys
+import threading
+from Queue import Queue
 
 import deepdish as dd
 import numpy as np
+import tables
+
+from .batch_container import BatchContainer, BatchContainerWriter
 
 
 class BootstrapBatch(object):
+    """Bootstrap batches of trials averaged in groups of the same label."""
+
     def __init__(self, arr, labels, group_size_max, batch_size, seed=42, auto_remove_files=True):
         self._seed = seed
         self.arr = arr
         self.labels = labels
-        self._indices = range(len(labels))
+        self._labels = np.asarray(labels)
+        self._class_indices = {label: np.flatnonzero(self._labels == label) for label in np.unique(self._labels)}
         self._batch_size = batch_size
         self.group_size_max = group_size_max
         self._curr_group_size = 1
-        self._curr_file_index = None
-        self._cache = defaultdict(list)
+        self._buffer = None
         self._auto_remove_files = auto_remove_files
-        np.random.rand(seed)
+        self._random_state = np.random.RandomState(seed)
+
+    def next_indices(self):
+        rs = self._random_state
+        self._curr_group_size = group_size = rs.randint(1, self.group_size_max + 1)
+        batch_labels = self._labels[rs.randint(0, len(self._labels), self._batch_size)]
+        indices = np.empty((self._batch_size, group_size), dtype=np.intp)
+        for label in np.unique(batch_labels):
+            mask = batch_labels == label
+            class_indices = self._class_indices[label]
+            indices[mask] = class_indices[rs.randint(0, len(class_indices), (mask.sum(), group_size))]
+        return indices, batch_labels.tolist()
+
+    def release_trials(self):
+        """Drop the trials, e.g. once a `BootstrapQueue` holds them; only `next_indices` works afterwards."""
+        self.arr = None
+        return self
 
-    def _add_to_group(self, key, arr):
-        self._cache[key].append(arr)
-        group = None
-        if len(self._cache[key]) >= self._curr_group_size:
-            values_list = self._cache.pop(key)
-            group = sum(values_list) / len(values_list)
-        return group, key
+    def next_samples(self):
+        if self.arr is None:
+            raise ValueError("The trials were released: only next_indices is available")
+        indices, batch_labels = self.next_indices()
+        group_size = indices.shape[1]
+        if self._buffer is None:
+            self._buffer = np.empty((self._batch_size * self.group_size_max, ) + self.arr.shape[1:],
+                                    dtype=self.arr.dtype)
+        n = self._batch_size * group_size
+        group = np.take(self.arr, indices.ravel(), axis=0, out=self._buffer[:n], mode='clip')
+        group = group.reshape((self._batch_size, group_size) + self.arr.shape[1:])
+        return group.mean(axis=1), batch_labels
 
     def next_batch(self):
-        batch = []
-        self._curr_group_size = np.random.choice(range(1, self.group_size_max + 1))
-        while len(batch) < self._batch_size:
-            k = np.random.choice(self._indices)
-            group, label = self._add_to_group(self.labels[k], self.arr[k])
-            if group is not None:
-                batch.append((group, label))
-        return batch
-
-    def create(self, max_iter, path, prefix):
-        bm = BootstrapBatchFiles(auto_remove=self._auto_remove_files, batch_size=self._batch_size)
+        samples, labels = self.next_samples()
+        return zip(samples, labels)
+
+    def stream(self, max_iter, prefetch=0):
+        return BootstrapBatchStream(self, max_iter, prefetch=prefetch)
+
+    def create(self, max_iter, path, prefix, prefetch=0, single_file=False):
+        if single_file:
+            container = os.path.join(path, "%sbatches.h5" % prefix)
+            with BatchContainerWriter(container, expected_batches=max_iter) as writer:
+                for _ in range(max_iter):
+                    writer.append(*self.next_samples())
+            return BootstrapBatchFiles(auto_remove=self._auto_remove_files, batch_size=self._batch_size,
+                                       prefetch=prefetch, container=container)
+        bm = BootstrapBatchFiles(auto_remove=self._auto_remove_files, batch_size=self._batch_size, prefetch=prefetch)
         for i in range(max_iter):
-            batch = self.next_batch()
-            samples = np.asarray(map(lambda x: x[0], batch))
-            labels = map(lambda x: x[1], batch)
+            samples, labels = self.next_samples()
             batch_file = os.path.join(path, "%s%s.hd5" % (prefix, i+1))
             dd.io.save(batch_file, {'samples': samples,
-                                    'labels': labels})
+                                    'labels': np.asarray(labels)})
             bm.append(batch_file)
         return bm
 
-    def load(self, path, prefix):
-        bm = BootstrapBatchFiles(auto_remove=self._auto_remove_files, batch_size=self._batch_size)
+    def load(self, path, prefix, prefetch=0):
+        container = os.path.join(path, "%sbatches.h5" % prefix)
+        if os.path.isfile(container):
+            return BootstrapBatchFiles(auto_remove=self._auto_remove_files, batch_size=self._batch_size,
+                                       prefetch=prefetch, container=container)
+        bm = BootstrapBatchFiles(auto_remove=self._auto_remove_files, batch_size=self._batch_size, prefetch=prefetch)
         pattern = os.path.join(path, prefix + "*.hd5")
         for batch_file in glob.glob(pattern):
             bm.append(batch_file)
         return bm
 
 
+class BootstrapBatchStream(object):
+    """Iterate over `max_iter` bootstrap batches generated in memory."""
+
+    def __init__(self, bootstrap_batch, max_iter, prefetch=0):
+        self._bootstrap_batch = bootstrap_batch
+        self._max_iter = max_iter
+        self._curr_index = 0
+        self._prefetch = prefetch
+        self._queue = None
+        self._stop = threading.Event()
+        self.size = bootstrap_batch._batch_size
+
+    @property
+    def count(self):
+        return self._curr_index
+
+    @property
+    def count_max(self):
+        return self._max_iter
+
+    def _producer(self, n):
+        try:
+            for _ in range(n):
+                if self._stop.is_set():
+                    return
+                self._queue.put(self._bootstrap_batch.next_samples())
+        except Exception:
+            self._queue.put(sys.exc_info())
+
+    def next_batch(self):
+        if self._curr_index >= self.count_max:
+            return None, None
+        if not self._prefetch:
+            self._curr_index += 1
+            return self._bootstrap_batch.next_samples()
+        if self._queue is None:
+            self._queue = Queue(maxsize=self._prefetch)
+            thread = threading.Thread(target=self._producer, args=(self.count_max - self._curr_index, ))
+            thread.daemon = True
+            thread.start()
+        item = self._queue.get()
+        if isinstance(item[0], type) and issubclass(item[0], BaseException):
+            raise item[0], item[1], item[2]
+        self._curr_index += 1
+        return item
+
+    def remove_batch_files(self):
+        # Nothing is written to disk; only stops the producer
+        self._stop.set()
+        if self._queue is not None and self._queue.full():
+            self._queue.get()
+        return self
+
+
 class BootstrapBatchFiles(object):
-    def __init__(self, batch_files=None, auto_remove=True, batch_size=None):
+    """Iterate over batch files or a container file; with `prefetch`, samples are recycled on the next call."""
+
+    def __init__(self, batch_files=None, auto_remove=True, batch_size=None, prefetch=0, container=None):
         self._curr_file_index = 0
         self._batch_files = batch_files or []
+        self._container = BatchContainer(container) if container else None
         self._auto_remove = auto_remove
         self.size = batch_size
+        self._prefetch = prefetch
+        self._queue = None
+        self._free_buffers = None
+        self._curr_buffer = None
+        self._stop = threading.Event()
 
     @property
     def count(self):
@@ -71,23 +167,98 @@ class BootstrapBatchFiles(object):
 
     @property
     def count_max(self):
+        if self._container is not None:
+            return len(self._container)
         return len(self._batch_files)
 
+    def _read(self, index, out=None):
+        if self._container is not None:
+            samples, labels = self._container.batch(index, out)
+            if self._auto_remove and index == self.count_max - 1:
+                self._remove_container()
+            return samples, labels
+        path = self._batch_files[index]
+        with tables.open_file(path, mode='r') as h5:
+            node = h5.get_node('/samples')
+            if out is None or out.shape != node.shape or out.dtype != node.dtype:
+                out = node.read()
+            else:
+                node.read(out=out)
+            node = h5.get_node('/labels')
+            labels = node.read() if isinstance(node, tables.Array) else None
+        if labels is None:
+            # Labels saved as a Python list, by an older version of `BootstrapBatch.create`
+            labels = dd.io.load(path, '/labels')
+        if self._auto_remove:
+            os.remove(path)
+        return out, labels
+
+    def _producer(self, start):
+        try:
+            for index in range(start, self.count_max):
+                buf = self._free_buffers.get()
+                if self._stop.is_set():
+                    return
+                self._queue.put(self._read(index, buf))
+            self._queue.put(None)
+        except Exception:
+            self._queue.put(sys.exc_info())
+
+    def _start_prefetch(self):
+        self._queue = Queue(maxsize=self._prefetch)
+        # One buffer per queue slot, plus the ones held by the producer and by the caller
+        self._free_buffers = Queue()
+        for _ in range(self._prefetch + 2):
+            self._free_buffers.put(None)
+        thread = threading.Thread(target=self._producer, args=(self._curr_file_index, ))
+        thread.daemon = True
+        thread.start()
+
+    def _next_prefetched(self):
+        if self._queue is None:
+            self._start_prefetch()
+        if self._curr_buffer is not None:
+            self._free_buffers.put(self._curr_buffer)
+            self._curr_buffer = None
+        item = self._queue.get()
+        if item is None:
+            self._queue.put(None)
+            return None, None
+        if isinstance(item[0], type) and issubclass(item[0], BaseException):
+            raise item[0], item[1], item[2]
+        self._curr_file_index += 1
+        self._curr_buffer = item[0]
+        return item
+
     def next_batch(self):
         if self._curr_file_index >= self.count_max:
             return None, None
-        path = self._batch_files[self._curr_file_index]
+        if self._prefetch:
+            return self._next_prefetched()
         self._curr_file_index += 1
-        data = dd.io.load(path)
-        if self._auto_remove:
-            os.remove(path)
-        return data['samples'], data['labels']
+        return self._read(self._curr_file_index - 1)
 
     def append(self, filename):
         self._batch_files.append(filename)
         return self
 
+    def stop_prefetch(self):
+        if self._free_buffers is not None:
+            self._stop.set()
+            self._free_buffers.put(None)
+        return self
+
+    def _remove_container(self):
+        file_name = self._container.file_name
+        self._container.close()
+        if os.path.isfile(file_name):
+            os.remove(file_name)
+        return self
+
     def remove_batch_files(self):
+        self.stop_prefetch()
+        if self._container is not None:
+            self._remove_container()
         for file_name in self._batch_files:
             if os.path.isfile(file_name):
                 os.remove(file_name)
@@ -3,8 +3,8 @@ from base.mongo_io import MongoIO
 
 class DataLoader(object):
     @staticmethod
-    def load(collection, _id=None):
+    def load(collection, _id=None, projection=None):
         coll = MongoIO(collection=collection)
         if _id:
-            return coll.load(criteria={'_id': _id})
-        return coll.load()[-1]
+            return coll.load(criteria={'_id': _id}, projection=projection)
+        return coll.load_latest(projection=projection)
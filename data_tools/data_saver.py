@@ -1,20 +1,65 @@
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+from pymongo import ReplaceOne, UpdateOne
+
 from base.mongo_io import MongoIO
 from .doc_to_id import doc_to_id
 from .json_default import json_default
 
 
 class DataSaver(object):
-    def __init__(self):
+    """Save documents in the DB, deriving a deterministic `_id` from their contents."""
+
+    def __init__(self, buffer_size=None, flush_interval=None):
         self.db = dict()
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._buffer = defaultdict(list)
+        self._buffer_count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+
+    @property
+    def buffered(self):
+        return bool(self.buffer_size or self.flush_interval)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def close(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        return self.flush()
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error("Failed to write the buffered documents: %s", e)
+
+    def _collection(self, collection):
+        if collection not in self.db.keys():
+            self.db[collection] = MongoIO(collection=collection)
+        return self.db[collection]
 
     def save(self, collection, doc=None, identifier=None, modify_object=False, replace_existing=True):
         if doc is None:
             return
         if not isinstance(doc, dict):
             raise TypeError("%s: doc should be a dictionary got type %s" % (self.__class__.__name__, type(doc)))
-        if collection not in self.db.keys():
-            self.db[collection] = MongoIO(collection=collection)
-        coll = self.db[collection]
+        coll = self._collection(collection)
         if not modify_object:
             doc = doc.copy()
         if "_id" not in doc:
@@ -22,17 +67,68 @@ class DataSaver(object):
                 doc["_id"] = identifier
             else:
                 doc["_id"] = doc_to_id(doc)
+        # Stamped after the _id, which only depends on the contents; MongoIO.load_latest sorts on it
+        doc.setdefault("update_time", datetime.now())
+        if self.buffered:
+            self._append(collection, doc, replace_existing)
+            return doc["_id"]
         if replace_existing:
             try:
                 coll.remove(doc["_id"])
             except Exception, e:
                 pass
-        elif coll.findOne({"_id": doc["_id"]}):
+        elif coll.collection.find_one({"_id": doc["_id"]}, {"_id": True}):
             return doc["_id"]
+        _id = coll.save(self._to_json(doc))
+        return _id
+
+    @staticmethod
+    def _to_json(doc):
         for key in doc.keys():
             if isinstance(doc[key], dict):
                 doc[key] = {k: json_default(doc[key][k]) for k in doc[key].keys()}
             elif key != "_id":
                 doc[key] = json_default(doc[key])
-        _id = coll.save(doc)
-        return _id
+        return doc
+
+    def _append(self, collection, doc, replace_existing):
+        doc = self._to_json(doc)
+        if replace_existing:
+            request = ReplaceOne({"_id": doc["_id"]}, doc, upsert=True)
+        else:
+            request = UpdateOne({"_id": doc["_id"]}, {"$setOnInsert": {k: v for k, v in doc.iteritems() if k != "_id"}},
+                                upsert=True)
+        with self._lock:
+            self._buffer[collection].append(request)
+            self._buffer_count += 1
+            full = self.buffer_size and self._buffer_count >= self.buffer_size
+            if self.flush_interval and self._flusher is None and not self._stop.is_set():
+                self._flusher = threading.Thread(target=self._flush_periodically)
+                self._flusher.daemon = True
+                self._flusher.start()
+        if full:
+            self.flush()
+        return self
+
+    def flush(self):
+        """Write the buffered requests, keeping those not written in the buffer if a write fails."""
+        with self._flush_lock:
+            with self._lock:
+                buffer, self._buffer = self._buffer, defaultdict(list)
+                self._buffer_count = 0
+            pending = [(collection, requests) for collection, requests in buffer.iteritems() if requests]
+            while pending:
+                collection, requests = pending[0]
+                try:
+                    self._collection(collection).bulk_write(requests)
+                except Exception:
+                    self._restore(pending)
+                    raise
+                pending.pop(0)
+        return self
+
+    def _restore(self, pending):
+        with self._lock:
+            for collection, requests in pending:
+                self._buffer[collection][:0] = requests
+                self._buffer_count += len(requests)
@@ -1,10 +1,8 @@
 import numpy as np
 from sklearn.cross_validation import train_test_split
 
-from brainpy.eeg import EEG
-
 from utils import one_hot_encoder
-from matlab_data_reader import matlab_data_reader
+from derivation_cache import read_derived_eeg
 
 
 class SimpleDataset(object):
@@ -85,23 +83,26 @@ class EEGDataSetBatch(object):
 
 
 # TODO: RESHAPE DATA FOR POTENTIAL AND LAPLACIAN
-def build_data_sets(file_name, name="no_name", avg_group_size=None, derivation=None, random_state=42, test_proportion=0.2):
-    eeg = EEG(data_reader=matlab_data_reader).read(file_name)
-    n_channels = eeg.n_channels
-    if avg_group_size:
-        eeg.average_trials(avg_group_size, inplace=True)
+def build_data_sets(file_name, name="no_name", avg_group_size=None, derivation=None, random_state=42, test_proportion=0.2,
+                    validation_proportion=0.):
     derivation = derivation or 'potential'
+    eeg = read_derived_eeg(file_name, derivation, avg_group_size=avg_group_size)
+    n_channels = eeg.n_channels
     if derivation.lower() == "electric_field":
-        eeg.get_electric_field(inplace=True)
         eeg.data = eeg.data.reshape(eeg.n_channels, eeg.trial_size, -1, 3).transpose((2, 0, 1, 3))
-    elif derivation.lower() == 'laplacian':
-        eeg.get_laplacian(inplace=True)
     n_classes = len(np.unique(eeg.trial_labels))
     labels = one_hot_encoder(eeg.trial_labels)
     X_train, X_test, y_train, y_test = train_test_split(eeg.data, labels, test_size=test_proportion,
                                                         random_state=random_state)
+    validation = None
+    if validation_proportion:
+        # Held out of the training set, e.g. for early stopping
+        X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, test_size=validation_proportion,
+                                                          random_state=random_state)
+        validation = type('Dataset', (), {'samples': X_val, 'labels': y_val})
     return type('DataSet', (), {'train': EEGDataSetBatch(X_train, y_train),
                                 'test': type('Dataset', (), {'samples': X_test, 'labels': y_test}),
+                                'validation': validation, 'validation_proportion': validation_proportion,
                                 'trial_size': eeg.trial_size, 'name': name, 'derivation': derivation,
                                 'avg_group_size': avg_group_size, 'random_state': random_state,
                                 'test_proportion': test_proportion, 'n_channels': n_channels,
@@ -0,0 +1,139 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+
+import numpy as np
+from brainpy.eeg import EEG
+
+import settings
+from .json_default import json_default
+from .trial_store import eeg_data_reader
+
+EEG_STATE_KEYS = ['sampling_rate', 'electrodes', 'trial_size', 'subject', 'trial_labels', 'der_code', 'group_size']
+
+_file_digests = dict()
+
+
+def file_digest(file_name, chunk_size=2 ** 24):
+    """MD5 of the file contents, memoized on (path, size, mtime) so that a file is hashed once per process."""
+    stat = os.stat(file_name)
+    key = (os.path.abspath(file_name), stat.st_size, stat.st_mtime)
+    if key not in _file_digests:
+        md5 = hashlib.md5()
+        with open(file_name, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                md5.update(chunk)
+        _file_digests[key] = md5.hexdigest()
+    return _file_digests[key]
+
+
+class DerivationCache(object):
+    """LRU disk cache of derived EEG arrays, memory-mapped on read."""
+
+    def __init__(self, path=None, max_bytes=None):
+        self.path = path or settings.DERIVATION_CACHE_DIR
+        self.max_bytes = max_bytes or settings.DERIVATION_CACHE_MAX_BYTES
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    @staticmethod
+    def key(file_name, derivation, lambda_value=None, avg_group_size=None):
+        word = json.dumps([file_digest(file_name), derivation.lower(), lambda_value, avg_group_size or 1])
+        return hashlib.md5(word).hexdigest()
+
+    def _files(self, key):
+        return os.path.join(self.path, key + ".npy"), os.path.join(self.path, key + ".json")
+
+    def get(self, key, mmap_mode='c'):
+        array_file, info_file = self._files(key)
+        if not os.path.isfile(info_file):
+            return None
+        try:
+            with io.open(info_file, encoding='utf-8') as f:
+                state = json.load(f)
+            state['trial_labels'] = np.asarray(state['trial_labels'])
+            state['data'] = np.load(array_file, mmap_mode=mmap_mode)
+            for file_name in (array_file, info_file):
+                os.utime(file_name, None)
+        except (IOError, OSError, ValueError) as e:
+            # Evicted or replaced by another process since the check above
+            logging.warning("Failed to read the cached derived EEG %s: %s", key, e)
+            return None
+        return state
+
+    def put(self, key, state):
+        array_file, info_file = self._files(key)
+        # Write to temporary files first, so that concurrent readers never see a partial entry
+        fd, tmp_file = tempfile.mkstemp(suffix=".npy", dir=self.path)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, np.asarray(state['data']))
+        os.rename(tmp_file, array_file)
+        doc = {k: json_default(v) for k, v in state.iteritems() if k != 'data'}
+        fd, tmp_file = tempfile.mkstemp(suffix=".json", dir=self.path)
+        with io.open(fd, 'w', encoding='utf-8') as f:
+            f.write(unicode(json.dumps(doc, default=json_default, ensure_ascii=False)))
+        os.rename(tmp_file, info_file)
+        self.evict()
+        return self
+
+    def entries(self):
+        entries = []
+        for file_name in os.listdir(self.path):
+            key, extension = os.path.splitext(file_name)
+            if extension != ".json" or key.startswith("tmp"):
+                continue
+            files = self._files(key)
+            try:
+                entries.append((os.path.getmtime(files[1]), sum(os.path.getsize(f) for f in files), key))
+            except OSError:
+                continue
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            for file_name in reversed(self._files(key)):
+                if os.path.isfile(file_name):
+                    os.remove(file_name)
+            total -= size
+            logging.info("Evicted the derived EEG %s from the cache", key)
+        return self
+
+
+def read_derived_eeg(file_name, derivation, lambda_value=None, avg_group_size=None, cache=None, cache_key=None):
+    """Read an EEG file, average its trials and apply the spatial derivation, reusing the cached result."""
+    derivation = (derivation or 'potential').lower()
+    if derivation not in ('potential', 'laplacian', 'electric_field'):
+        raise KeyError("Derivation '%s' is not supported" % derivation)
+    eeg_kwargs = {} if lambda_value is None else {'lambda_value': lambda_value}
+    use_cache = cache is not False and (derivation != 'potential' or (avg_group_size or 1) > 1)
+    if use_cache:
+        cache = cache or DerivationCache()
+        key = cache_key or cache.key(file_name, derivation, lambda_value, avg_group_size)
+        state = cache.get(key)
+        if state is not None:
+            logging.info("Loaded the %s derivation of %s from the cache", derivation, file_name)
+            return EEG(data_reader=lambda _: state, **eeg_kwargs).read(file_name)
+
+    eeg = EEG(data_reader=eeg_data_reader, **eeg_kwargs).read(file_name)
+    if (avg_group_size or 1) > 1:
+        eeg.average_trials(avg_group_size, inplace=True)
+    if derivation == 'laplacian':
+        eeg.get_laplacian(inplace=True)
+    elif derivation == 'electric_field':
+        eeg.get_electric_field(inplace=True)
+
+    if use_cache:
+        state = {k: getattr(eeg, k) for k in EEG_STATE_KEYS}
+        state['data'] = eeg.data
+        try:
+            cache.put(key, state)
+        except Exception as e:
+            logging.error("Failed to cache the %s derivation of %s: %s", derivation, file_name, e)
+    return eeg
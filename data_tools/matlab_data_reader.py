@@ -5,17 +5,23 @@ import pandas as pd
 from scipy.io import loadmat
 
 
+def deinterleave_channels(data, trial_size):
+    """Rearrange a (n_trials, n_channels * trial_size) matrix into (n_channels, trial_size * n_trials)."""
+    n_trials, n = data.shape
+    n_channels = n // trial_size
+    assert n == n_channels * trial_size
+    return data.reshape(n_trials, n_channels, trial_size).transpose((1, 0, 2)).reshape(n_channels, -1)
+
+
 def matlab_data_reader(file_name, labels='categoryLabels'):
     path = os.path.split(file_name)[0]
     elect_file = os.path.join(path, "elect.csv")
     electrodes = pd.read_csv(elect_file, index_col=False).to_dict(orient="records")
     mat = loadmat(file_name)
     trial_size = mat['N'].ravel()[0]
-    data = mat.pop('X')
-    n_trials, n = data.shape
-    n_channels = n // trial_size
-    assert n == n_channels * trial_size
-    data = np.array([data[:, k * trial_size:][:, :trial_size].ravel() for k in range(n_channels)])
+    n_trials = mat['X'].shape[0]
+    data = deinterleave_channels(mat.pop('X'), trial_size)
+    n_channels = data.shape[0]
     assert data.shape == (n_channels, trial_size * n_trials)
     return dict(sampling_rate=mat['Fs'].ravel()[0],
                 data=data[:, :, np.newaxis],
@@ -33,6 +39,6 @@ cached_data = dict()
 def get_matlab_labels(filename, labels='categoryLabels'):
     data = cached_data.get(filename)
     if not data:
-        data = loadmat(filename)[labels].ravel().tolist()
+        data = loadmat(filename, variable_names=[labels])[labels].ravel().tolist()
         cached_data[filename] = data
     return data
@@ -0,0 +1,138 @@
+import logging
+import socket
+import time
+
+import numpy as np
+from brainpy.eeg import EEG
+
+from .trial_store import eeg_data_reader
+
+
+class RingBuffer(object):
+    """Latest samples of a multichannel stream, written twice so that every window is a contiguous view."""
+
+    def __init__(self, n_channels, capacity, dtype=np.float32):
+        self.capacity = capacity
+        self._data = np.zeros((n_channels, 2 * capacity), dtype=dtype)
+        self._pos = 0
+        self.n_samples = 0
+
+    def append(self, block):
+        self.n_samples += block.shape[1]
+        block = block[:, -self.capacity:]
+        n = block.shape[1]
+        first = min(n, self.capacity - self._pos)
+        for offset in (0, self.capacity):
+            self._data[:, self._pos + offset:self._pos + offset + first] = block[:, :first]
+            self._data[:, offset:offset + n - first] = block[:, first:]
+        self._pos = (self._pos + n) % self.capacity
+        return self
+
+    def window(self, end, n):
+        lag = self.n_samples - end
+        assert 0 <= lag and n + lag <= min(self.capacity, self.n_samples), "The window is no longer in the buffer"
+        stop = self._pos + self.capacity - lag
+        return self._data[:, stop - n:stop]
+
+
+def derivation_operator(electrodes, derivation, lambda_value=None):
+    """Linear operator of an EEG derivation as an (n_out, n_channels, n_comps) array, None for the potential."""
+    derivation = (derivation or 'potential').lower()
+    if derivation == 'potential':
+        return None
+    n_channels = len(electrodes)
+    state = dict(sampling_rate=1., data=np.eye(n_channels)[:, :, np.newaxis], electrodes=electrodes,
+                 trial_size=n_channels, subject=0, trial_labels=np.zeros(1), der_code=0, group_size=1)
+    eeg_kwargs = {} if lambda_value is None else {'lambda_value': lambda_value}
+    eeg = EEG(data_reader=lambda _: state, **eeg_kwargs).read(None)
+    if derivation == 'laplacian':
+        eeg.get_laplacian(inplace=True)
+    elif derivation == 'electric_field':
+        eeg.get_electric_field(inplace=True)
+    else:
+        raise KeyError("Derivation '%s' is not supported" % derivation)
+    operator = np.asarray(eeg.data, dtype=np.float32)
+    if operator.ndim == 2:
+        operator = operator[:, :, np.newaxis]
+    return operator
+
+
+def apply_operator(operator, block):
+    if operator is None:
+        return block[:, :, np.newaxis]
+    return np.einsum('ock,ct->otk', operator, block)
+
+
+def file_replay(file_name, block_size=16, real_time=False):
+    """Replay the trials of a recording as a continuous stream of (n_channels, block_size) blocks."""
+    info = eeg_data_reader(file_name)
+    data = info['data'][:, :, 0]
+    period = float(block_size) / info['sampling_rate'] if real_time else 0
+    next_time = time.time()
+    for start in range(0, data.shape[1], block_size):
+        if period:
+            next_time += period
+            time.sleep(max(0, next_time - time.time()))
+        yield np.asarray(data[:, start:start + block_size], dtype=np.float32)
+
+
+def socket_source(host, port, n_channels, block_size=16, dtype=np.float32):
+    """Read a stream of samples from a TCP socket, as raw `dtype` values with the channels of each sample adjacent."""
+    frame_bytes = n_channels * block_size * np.dtype(dtype).itemsize
+    conn = socket.create_connection((host, port))
+    try:
+        pending = b''
+        while True:
+            chunk = conn.recv(frame_bytes - len(pending))
+            if not chunk:
+                break
+            pending += chunk
+            if len(pending) == frame_bytes:
+                yield np.frombuffer(pending, dtype=dtype).reshape((block_size, n_channels)).T
+                pending = b''
+    finally:
+        conn.close()
+
+
+class OnlineClassifier(object):
+    """Classify the sliding windows of a continuous stream, skipping stale ones when scoring falls behind."""
+
+    def __init__(self, model, n_channels, trial_size, step=None, operator=None, max_pending=2):
+        self.model = model
+        self.trial_size = trial_size
+        self.step = step or trial_size
+        self.operator = operator
+        self.max_pending = max_pending
+        self._n_out, self._n_comps = (n_channels, 1) if operator is None else (operator.shape[0], operator.shape[2])
+        self._buffer = RingBuffer(self._n_out * self._n_comps, trial_size + self.step * max_pending)
+        self._next_end = trial_size
+        self.n_skipped = 0
+
+    def _window(self, end):
+        window = self._buffer.window(end, self.trial_size)
+        return window.reshape((self._n_out, self._n_comps, self.trial_size)).transpose((0, 2, 1))
+
+    def process(self, block):
+        """Append a (n_channels, n) block and return (end_sample, label, probabilities, latency_ms) per window."""
+        received = time.time()
+        derived = apply_operator(self.operator, block).transpose((0, 2, 1))
+        self._buffer.append(derived.reshape((self._n_out * self._n_comps, -1)))
+        n_samples = self._buffer.n_samples
+        if n_samples < self._next_end:
+            return []
+        ends = range(self._next_end, n_samples + 1, self.step)
+        self._next_end = ends[-1] + self.step
+        if len(ends) > self.max_pending:
+            self.n_skipped += len(ends) - self.max_pending
+            ends = ends[-self.max_pending:]
+        probabilities = self.model.predict_proba(np.asarray([self._window(end) for end in ends]))
+        latency = 1e3 * (time.time() - received)
+        classes = np.asarray(self.model.classes)
+        return [(end, classes[np.argmax(p)], p, latency) for end, p in zip(ends, probabilities)]
+
+    def run(self, source):
+        for block in source:
+            for result in self.process(block):
+                yield result
+        if self.n_skipped:
+            logging.info("Skipped %s windows to keep up with the stream", self.n_skipped)
@@ -0,0 +1,75 @@
+import io
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import settings
+from .json_default import json_default
+from .matlab_data_reader import get_matlab_labels, matlab_data_reader
+
+
+def trial_store_files(file_name, store_dir=None):
+    path, base_name = os.path.split(file_name)
+    base_name = os.path.splitext(base_name)[0]
+    path = store_dir or settings.TRIAL_STORE_DIR or path
+    return os.path.join(path, base_name + ".npy"), os.path.join(path, base_name + ".json")
+
+
+def has_trial_store(file_name, store_dir=None):
+    """True if a trial store exists for the file and is not older than the file itself."""
+    array_file, info_file = trial_store_files(file_name, store_dir)
+    if not (os.path.isfile(array_file) and os.path.isfile(info_file)):
+        return False
+    return not os.path.isfile(file_name) or os.path.getmtime(info_file) >= os.path.getmtime(file_name)
+
+
+def convert_matlab_file(file_name, store_dir=None, labels='categoryLabels'):
+    """Parse a MATLAB subject file once into a raw .npy array plus a JSON sidecar."""
+    array_file, info_file = trial_store_files(file_name, store_dir)
+    info = matlab_data_reader(file_name, labels=labels)
+    data = info.pop('data')
+    # Written to temporary files renamed over the store, so that processes mapping it never see a partial file
+    fd, tmp_file = tempfile.mkstemp(suffix=".npy", dir=os.path.dirname(array_file))
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, np.ascontiguousarray(data))
+    os.rename(tmp_file, array_file)
+    info.update({'source': file_name, 'n_channels': data.shape[0], 'n_trials': data.shape[1] // info['trial_size'],
+                 'n_comps': data.shape[2], 'dtype': str(data.dtype)})
+    info = {k: json_default(v) for k, v in info.iteritems()}
+    # The sidecar is renamed last: its presence marks the store as complete
+    fd, tmp_file = tempfile.mkstemp(suffix=".json", dir=os.path.dirname(info_file))
+    with io.open(fd, 'w', encoding='utf-8') as f:
+        f.write(unicode(json.dumps(info, default=json_default, ensure_ascii=False)))
+    os.rename(tmp_file, info_file)
+    return array_file, info_file
+
+
+def trial_store_reader(file_name, store_dir=None, mmap_mode='c'):
+    """Data reader compatible with matlab_data_reader that memory-maps the trial store."""
+    array_file, info_file = trial_store_files(file_name, store_dir)
+    with io.open(info_file, encoding='utf-8') as f:
+        info = json.load(f)
+    return dict(sampling_rate=info['sampling_rate'],
+                data=np.load(array_file, mmap_mode=mmap_mode),
+                electrodes=info['electrodes'],
+                trial_size=info['trial_size'],
+                subject=info['subject'],
+                trial_labels=np.asarray(info['trial_labels']),
+                der_code=info['der_code'],
+                group_size=info['group_size'])
+
+
+def eeg_data_reader(file_name, labels='categoryLabels'):
+    """Read the trial store when it is available and fall back to parsing the MATLAB file otherwise."""
+    if labels == 'categoryLabels' and has_trial_store(file_name):
+        return trial_store_reader(file_name)
+    return matlab_data_reader(file_name, labels=labels)
+
+
+def trial_labels(file_name, labels='categoryLabels'):
+    """Trial labels of a subject file, read from its trial store when it is available."""
+    if labels == 'categoryLabels' and has_trial_store(file_name):
+        return trial_store_reader(file_name)['trial_labels'].tolist()
+    return get_matlab_labels(file_name, labels=labels)
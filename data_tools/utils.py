@@ -4,16 +4,16 @@ import numpy as np
 
 
 def one_hot_encoder(arr):
-    levels = np.unique(arr)
-    mat = np.eye(len(levels))
-    d = {v: mat[:, j] for j, v in enumerate(levels)}
-    return np.array([d[v] for v in arr])
+    levels, codes = np.unique(arr, return_inverse=True)
+    return np.eye(len(levels))[codes]
 
 
 class OneHotEncoder(object):
-    def __init__(self):
-        self._d = dict()
+    """One-hot encoding of labels into the sorted levels seen by `fit`."""
+
+    def __init__(self, dtype=np.float32):
         self._levels = np.array([])
+        self.dtype = dtype
 
     @property
     def levels(self):
@@ -25,18 +25,34 @@ class OneHotEncoder(object):
 
     def fit(self, x):
         self._levels = np.unique(x)
-        mat = np.eye(len(self._levels))
-        self._d = {v: mat[:, j] for j, v in enumerate(self._levels)}
         return self
 
-    def transform(self, x):
-        return self._d[x]
+    def codes(self, x):
+        x = np.asarray(x)
+        codes = np.searchsorted(self._levels, x)
+        invalid = (codes >= self.n_levels) | (self._levels[np.minimum(codes, self.n_levels - 1)] != x)
+        if np.any(invalid):
+            raise KeyError("Unknown labels: %s" % np.unique(x[invalid]).tolist())
+        return codes.astype(np.min_scalar_type(max(self.n_levels - 1, 0)))
+
+    def transform(self, x, sparse=False):
+        codes = self.codes(x)
+        if sparse:
+            return codes
+        return np.eye(self.n_levels, dtype=self.dtype)[codes]
+
+    def inverse_transform(self, y):
+        return self._levels[np.argmax(y, axis=-1)]
+
+    def inverse_codes(self, codes):
+        return self._levels[codes]
 
     def to_json(self):
-        return json.dumps({'_d': {k: list(v) for k, v in self._d.iteritems()}, '_levels': list(self._levels)})
+        mat = np.eye(self.n_levels)
+        return json.dumps({'_d': {str(v): list(mat[:, j]) for j, v in enumerate(self._levels)},
+                           '_levels': self._levels.tolist()})
 
     def from_json(self, json_obj):
         d = json.loads(json_obj)
-        self._d = {k: np.array(v) for k, v in d.get('_d', {}).iteritems()}
         self._levels = np.array(d.get('_levels', []))
         return self
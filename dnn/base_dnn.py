@@ -1,6 +1,13 @@
 import functools
+import time
+
 import tensorflow as tf
 
+from dnn.cpu_profile import CPUProfile
+from dnn.input_pipeline import FeedQueue
+from dnn.running_averages import RunningAverages
+from dnn.step_profile import StepProfile
+
 
 def doublewrap(function):
     """
@@ -57,6 +64,7 @@ class BaseDNN(object):
         self.dropout = dropout  # Dropout, probability to keep units
         self.image = None
         self.label = None
+        self.step_profile = None
 
     @property
     def outputs(self):
@@ -145,34 +153,43 @@ class BaseDNN(object):
         out = tf.add(tf.matmul(fc1_dropout, weights['out']), biases['out'])
         return out
 
-    def fit(self, dataset):
-        # tf Graph input
-        self.image = tf.placeholder(tf.float32, shape=[None, self.n_channels, self.trial_size, self.n_comps])
-        self.label = tf.placeholder(tf.float32, shape=[None, self.n_classes])
+    def fit(self, dataset, capacity=8, cpu_profile=None):
+        # tf Graph input, dequeued from the batches of `dataset.train` prepared in a background thread
+        pipeline = FeedQueue(lambda: dataset.train.next_batch(self.batch_size),
+                             (self.n_channels, self.trial_size, self.n_comps), self.n_classes, capacity=capacity,
+                             size=self.batch_size)
+        self.image, self.label = pipeline.dequeue()
         self.optimize
         self.accuracy
         self.prediction
-        keep_prob = tf.placeholder(tf.float32)  # dropout (keep probability)
 
         # Launch the graph
-        with tf.Session() as sess:
+        with (cpu_profile or CPUProfile()).session() as sess:
             sess.run(tf.initialize_all_variables())
+            pipeline.start(sess)
+            averages = RunningAverages()
+            self.step_profile = profile = StepProfile(capacity=self.max_iter // self.batch_size)
             step = 1
-            # Keep training until reach max iterations
-            while step * self.batch_size < self.max_iter:
-                batch_x, batch_y = dataset.train.next_batch(self.batch_size)
-                # Run optimization op (backprop)
-                sess.run(self.optimize, feed_dict={self.image: batch_x, self.label: batch_y, keep_prob: 0.5})
-                if step % self.display_step == 0:
-                    # Calculate batch loss and accuracy
-                    loss, acc = sess.run([self.cost, self.accuracy],
-                                         feed_dict={self.image: batch_x, self.label: batch_y, keep_prob: 1.})
-                    print("Iter " + str(step * self.batch_size) + ", Minibatch Loss= " + "{:.6f}".format(
-                        loss) + ", Training Accuracy= " + "{:.5f}".format(acc))
-                step += 1
+            try:
+                # Keep training until reach max iterations
+                while step * self.batch_size < self.max_iter:
+                    profile.start_step()
+                    start = time.time()
+                    # Run optimization op (backprop), with the loss and accuracy of its own forward pass
+                    _, loss, acc = sess.run([self.optimize, self.cost, self.accuracy])
+                    profile.add_run(start, time.time(), pipeline.ready_time(step - 1))
+                    with profile.phase('logging'):
+                        averages.update(loss=loss, acc=acc)
+                        if step % self.display_step == 0:
+                            print("Iter " + str(step * self.batch_size) + ", Minibatch Loss= " + "{:.6f}".format(
+                                averages['loss']) + ", Training Accuracy= " + "{:.5f}".format(averages['acc']))
+                    profile.end_step(self.batch_size)
+                    step += 1
+            finally:
+                pipeline.stop(sess)
             print("Optimization Finished!")
+            print("Profile:", profile.summary())
 
             # Calculate accuracy for 256 mnist test images
             print("Testing Accuracy:", sess.run(self.accuracy, feed_dict={self.image: dataset.test.samples,
-                                                                          self.label: dataset.test.labels,
-                                                                          keep_prob: 1.}))
+                                                                          self.label: dataset.test.labels}))
@@ -1,4 +1,5 @@
 import logging
+import time
 import traceback
 from datetime import datetime
 
@@ -6,9 +7,40 @@ import numpy as np
 import tensorflow as tf
 
 from data_tools.utils import OneHotEncoder
+from dnn.cpu_profile import CPUProfile
+from dnn.early_stopping import EarlyStopping
+from dnn.inference import predict_batches
+from dnn.input_pipeline import FeedQueue, QueueInput
+from dnn.metrics_recorder import MetricsRecorder
+from dnn.running_averages import RunningAverages
+from dnn.step_profile import StepProfile
+
+
+def weight_variable(shape, name):
+    initial = tf.truncated_normal(shape, stddev=0.1)
+    return tf.Variable(initial, name=name)
+
+
+def bias_variable(shape, name):
+    initial = tf.constant(0.1, shape=shape)
+    return tf.Variable(initial, name=name)
+
+
+def conv2d(x, W):
+    return tf.nn.conv2d(x, W, strides=[1, 1, 1, 1], padding='SAME')
+
+
+def max_pool_2x2(x):
+    return tf.nn.max_pool(x, ksize=[1, 2, 2, 1], strides=[1, 2, 2, 1], padding='SAME')
+
+
+def average(tensors):
+    return tensors[0] if len(tensors) == 1 else tf.add_n(list(tensors)) / len(tensors)
 
 
 class ConvNet(object):
+    HISTORY_COLUMNS = ('step', 'last_iter', 'loss', 'acc', 'clean_loss', 'clean_acc')
+
     def __init__(self, W_conv1, bias_conv1, W_conv2, bias_conv2, W_fc1, bias_fc1, W_fc2, bias_fc2, trial_size,
                  n_comps, n_channels, n_classes, learning_rate=1e-3):
         self.W_conv1 = W_conv1
@@ -25,49 +57,58 @@ class ConvNet(object):
         self.n_classes = n_classes
         self.learning_rate = learning_rate
         self.label_encoder = OneHotEncoder().fit(range(1, n_classes+1))
-        self.train_accuracy = list()
-
-    def train(self, batcher, output_filename=None):
-        def weight_variable(shape, name):
-            initial = tf.truncated_normal(shape, stddev=0.1)
-            return tf.Variable(initial, name=name)
+        self.history = None
+        self.validation_history = None
+        self.early_stopping = None
+        self.train_averages = dict()
+        self.step_profile = None
+        self._sess = None
+        self._x = None
+        self._y_pred = None
+        self._y_prob = None
 
-        def bias_variable(shape, name):
-            initial = tf.constant(0.1, shape=shape)
-            return tf.Variable(initial, name=name)
+    @classmethod
+    def from_doc(cls, doc):
+        return cls(doc['W_conv1'], doc['bias_conv1'], doc['W_conv2'], doc['bias_conv2'], doc['W_fc1'], doc['bias_fc1'],
+                   doc['W_fc2'], doc['bias_fc2'], doc['trial_size'], doc['n_comps'], doc['n_channels'],
+                   doc['n_classes'], learning_rate=doc.get('learning_rate', 1e-3))
 
-        def conv2d(x, W):
-            return tf.nn.conv2d(x, W, strides=[1, 1, 1, 1], padding='SAME')
+    @property
+    def classes(self):
+        return self.label_encoder.levels
 
-        def max_pool_2x2(x):
-            return tf.nn.max_pool(x, ksize=[1, 2, 2, 1], strides=[1, 2, 2, 1], padding='SAME')
+    @property
+    def trial_shape(self):
+        return self.n_channels, self.trial_size, self.n_comps
 
+    def _input(self):
         # The input x will consist of a tensor of floating point numbers of shape (?, 124, 32, 3)
-        x = tf.placeholder(tf.float32, shape=[None, self.n_channels, self.trial_size, self.n_comps])
-        # The target output classes y_ will consist of a 2d tensor, where each row is a one-hot 6-dimensional vector
-        # indicating which digit class (zero through 5) the corresponding trial belongs to
-        y_ = tf.placeholder(tf.float32, shape=[None, self.n_classes])
+        return tf.placeholder(tf.float32, shape=(None, ) + self.trial_shape)
+
+    def _variables(self):
+        return [weight_variable(self.W_conv1, "W_conv1"), bias_variable(self.bias_conv1, "bias_conv1"),
+                weight_variable(self.W_conv2, "W_conv2"), bias_variable(self.bias_conv2, "bias_conv2"),
+                weight_variable(self.W_fc1, "weights_fc1"), bias_variable(self.bias_fc1, "bias_fc1"),
+                weight_variable(self.W_fc2, "weights_fc2"), bias_variable(self.bias_fc2, "bias_fc2")]
+
+    def _network(self, x, keep_prob=None, variables=None):
+        """Add the network to the current graph and return its logits and variables."""
+        variables = variables or self._variables()
+        W_conv1, b_conv1, W_conv2, b_conv2, W_fc1, b_fc1, W_fc2, b_fc2 = variables
 
         # First Convolutional Layer.
-        W_conv1 = weight_variable(self.W_conv1, "W_conv1")
-        # a bias vector with a component for each output channel
-        b_conv1 = bias_variable(self.bias_conv1, "bias_conv1")
         # Apply the layer by convolving x with the weight tensor, add the bias, and apply the ReLU function
         h_conv1 = tf.nn.relu(conv2d(x, W_conv1) + b_conv1)
         # Finally max pool with a 2x2 patch. The result has shape (?, 62, 8, 32)
         h_pool1 = max_pool_2x2(h_conv1)
 
         # Second Convolutional Layer.
-        W_conv2 = weight_variable(self.W_conv2, "W_conv2")
-        b_conv2 = bias_variable(self.bias_conv2, "bias_conv2")
         # h_conv2 has dimension (?, 62, 16, 64)
         h_conv2 = tf.nn.relu(conv2d(h_pool1, W_conv2) + b_conv2)
         # h_pool2 has dimension (?, 31, 8, 64)
         h_pool2 = max_pool_2x2(h_conv2)
 
         # Densely-connected Layer.
-        W_fc1 = weight_variable(self.W_fc1, "weights_fc1")
-        b_fc1 = bias_variable(self.bias_fc1, "bias_fc1")
         h_pool2_flat = tf.reshape(h_pool2, [-1, self.W_fc1[0]])
         h_fc1 = tf.nn.relu(tf.matmul(h_pool2_flat, W_fc1) + b_fc1)
 
@@ -75,50 +116,201 @@ class ConvNet(object):
         # the probability that a neuron's output is kept during dropout. This allows us to turn dropout on during
         # training, and turn it off during testing. TensorFlow's tf.nn.dropout op automatically handles scaling neuron
         # outputs in addition to masking them, so dropout just works without any additional scaling.
-        keep_prob = tf.placeholder(tf.float32)
-        h_fc1_drop = tf.nn.dropout(h_fc1, keep_prob)
+        if keep_prob is not None:
+            h_fc1 = tf.nn.dropout(h_fc1, keep_prob)
 
         # Readout Layer
         # Finally, we add a layer, just like for the one layer softmax regression above.
-        W_fc2 = weight_variable(self.W_fc2, "weights_fc2")
-        b_fc2 = bias_variable(self.bias_fc2, "bias_fc2")
-
         # implements the convolutional model
-        y_conv = tf.matmul(h_fc1_drop, W_fc2) + b_fc2
+        y_conv = tf.matmul(h_fc1, W_fc2) + b_fc2
+        return y_conv, variables
 
-        # the loss function is the cross-entropy between the target and the softmax activation function applied to the
-        # model's prediction. The function tf.nn.softmax_cross_entropy_with_logits internally applies the softmax on the
-        # model's unnormalized model prediction and sums across all classes, and tf.reduce_mean takes the average over
-        # these sums.
-        cross_entropy = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(y_conv, y_))
+    def _training(self, inputs, devices=None, variables=None):
+        """Add one replica of the network per input and device, with their averaged training ops."""
+        devices = devices or [None] * len(inputs)
+        keep_prob = tf.placeholder(tf.float32)
+        optimizer = tf.train.AdamOptimizer(self.learning_rate)
+        if variables is None:
+            with tf.device(devices[0]):
+                variables = self._variables()
+        losses, accuracies, gradients = [], [], []
+        for i, ((x, y_), device) in enumerate(zip(inputs, devices)):
+            with tf.device(device), tf.name_scope('replica_%d' % i):
+                y_conv, _ = self._network(x, keep_prob, variables)
+
+                # the loss function is the cross-entropy between the target and the softmax activation function
+                # applied to the model's prediction. The function tf.nn.softmax_cross_entropy_with_logits internally
+                # applies the softmax on the model's unnormalized model prediction and sums across all classes, and
+                # tf.reduce_mean takes the average over these sums.
+                cross_entropy = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(y_conv, y_))
+                losses.append(cross_entropy)
+                gradients.append([grad for grad, var in optimizer.compute_gradients(cross_entropy, var_list=variables)])
+
+                correct_prediction = tf.equal(tf.argmax(y_conv, 1), tf.argmax(y_, 1))
+                accuracies.append(tf.reduce_mean(tf.cast(correct_prediction, tf.float32)))
 
         # uses steepest gradient descent to descend the cross entropy.
-        train_step = tf.train.AdamOptimizer(self.learning_rate).minimize(cross_entropy)
+        train_step = optimizer.apply_gradients([(average(g), v) for g, v in zip(zip(*gradients), variables)])
+        return keep_prob, average(losses), train_step, average(accuracies)
 
-        correct_prediction = tf.equal(tf.argmax(y_conv, 1), tf.argmax(y_, 1))
-        accuracy = tf.reduce_mean(tf.cast(correct_prediction, tf.float32))
+    def _clean_statistics(self, inputs, devices, variables, train_step):
+        """Loss and accuracy without dropout on the batches of `inputs`, after the update of `train_step`."""
+        devices = devices or [None] * len(inputs)
+        losses, accuracies = [], []
+        with tf.control_dependencies([train_step]):
+            # Read the variables inside the dependency, so that they hold the values after the update
+            variables = [tf.identity(v) for v in variables]
+            for i, ((x, y_), device) in enumerate(zip(inputs, devices)):
+                with tf.device(device), tf.name_scope('clean_%d' % i):
+                    y_conv, _ = self._network(x, variables=variables)
+                    losses.append(tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(y_conv, y_)))
+                    correct_prediction = tf.equal(tf.argmax(y_conv, 1), tf.argmax(y_, 1))
+                    accuracies.append(tf.reduce_mean(tf.cast(correct_prediction, tf.float32)))
+        return average(losses), average(accuracies)
+
+    def input_pipeline(self, batcher, capacity=8):
+        if isinstance(batcher, QueueInput):
+            return batcher
+        return FeedQueue.from_batcher(batcher, self.trial_shape, self.label_encoder,
+                                      capacity=capacity)
+
+    def train(self, batcher, output_filename=None, cpu_profile=None, validation=None, early_stopping=None,
+              eval_batch_size=256, clean_every=100, log_every=10, history_file=None):
+        """Train on the batches of `batcher`, with optional validation and early stopping."""
+        cpu_profile = cpu_profile or CPUProfile()
+        pipeline = self.input_pipeline(batcher)
+        devices = cpu_profile.devices
+        with tf.device(devices[0]):
+            variables = self._variables()
+        # The target output classes y_ will consist of a 2d tensor, where each row is a one-hot 6-dimensional vector
+        # indicating which digit class (zero through 5) the corresponding trial belongs to
+        inputs = [pipeline.dequeue() for _ in devices]
+        keep_prob, cross_entropy, train_step, accuracy = self._training(inputs, devices, variables)
+        clean_cross_entropy, clean_accuracy = self._clean_statistics(inputs, devices, variables, train_step)
+        if validation is not None:
+            early_stopping = early_stopping or EarlyStopping()
+            x_val = self._input()
+            y_val_pred = tf.argmax(self._network(x_val, variables=variables)[0], 1)
+            val_samples, val_codes = np.asarray(validation[0]), self.label_encoder.codes(validation[1])
+        self.early_stopping = early_stopping
 
         saver = tf.train.Saver()
-        sess = tf.Session()
+        sess = cpu_profile.session()
         sess.run(tf.initialize_all_variables())
 
-        self.train_accuracy = []
+        profile = StepProfile(capacity=(pipeline.count_max or 0) // len(devices) + 1)
+
+        def save():
+            try:
+                with profile.phase('checkpoint'):
+                    save_path = saver.save(sess, output_filename)
+                logging.info("Successfully saved the model to %s", save_path)
+            except Exception as e:
+                logging.error("Failed to save the model: %s\n%s", e, traceback.format_exc())
+
+        def validate(step):
+            with profile.phase('validation'):
+                y_pred = predict_batches(sess, [y_val_pred], x_val, val_samples, batch_size=eval_batch_size)[0]
+            acc = float(np.mean(y_pred == val_codes))
+            improved = early_stopping.update(step, acc)
+            logging.info("%s: step %d - validation accuracy: %g (best %g at step %d)", datetime.now().isoformat(), step,
+                         acc, early_stopping.best_score, early_stopping.best_step)
+            self.validation_history.append(step=step, acc=acc)
+            if improved and output_filename:
+                save()
+
+        self.history = MetricsRecorder(self.HISTORY_COLUMNS, capacity=(pipeline.count_max or 0) // len(devices) + 1,
+                                       file_name=history_file)
+        self.validation_history = MetricsRecorder(('step', 'acc'))
+        averages = RunningAverages()
+        fetches = [train_step, cross_entropy, accuracy]
+        clean_fetches = fetches + [clean_cross_entropy, clean_accuracy]
         with sess.as_default():
-            logging.info("Training the network with a maximum of %s batches of size %s", batcher.count_max,
-                         batcher.size)
+            logging.info("Training the network with a maximum of %s batches of size %s with %s", pipeline.count_max,
+                         pipeline.size, cpu_profile)
             last_iter = 0
-            samples, labels = batcher.next_batch()
-            labels = np.asarray([self.label_encoder.transform(lab) for lab in labels])
-            while samples is not None:
-                acc = accuracy.eval(feed_dict={x: samples, y_: labels, keep_prob: 1.0})
-                logging.info("%s: last iter %d - training accuracy: %g", datetime.now().isoformat(), last_iter, acc)
-                train_step.run(feed_dict={x: samples, y_: labels, keep_prob: 0.5})
-                last_iter += batcher.size
-                self.train_accuracy.append({'last_iter': last_iter, 'acc': float(acc)})
-            if output_filename:
-                try:
-                    save_path = saver.save(sess, output_filename)
-                    logging.info("Successfully saved the model to %s", save_path)
-                except Exception as e:
-                    logging.error("Failed to save the model: %s\n%s", e, traceback.format_exc())
-        return self.train_accuracy
+            step = 0
+            pipeline.start(sess)
+            try:
+                while True:
+                    clean = clean_every and (step + 1) % clean_every == 0
+                    profile.start_step()
+                    start = time.time()
+                    values = sess.run(clean_fetches if clean else fetches, feed_dict={keep_prob: 0.5})
+                    profile.add_run(start, time.time(), pipeline.ready_time((step + 1) * len(devices) - 1))
+                    step += 1
+                    last_iter += pipeline.size * len(devices)
+                    with profile.phase('logging'):
+                        loss, acc = values[1:3]
+                        averages.update(loss=loss, acc=acc)
+                        if clean:
+                            averages.update(clean_loss=values[3], clean_acc=values[4])
+                            self.history.append(step=step, last_iter=last_iter, loss=loss, acc=acc,
+                                                clean_loss=values[3], clean_acc=values[4])
+                            logging.info("%s: step %d - clean training loss: %g, accuracy: %g",
+                                         datetime.now().isoformat(), step, values[3], values[4])
+                        else:
+                            self.history.append(step=step, last_iter=last_iter, loss=loss, acc=acc)
+                        if step % log_every == 0:
+                            logging.info("%s: last iter %d - training loss: %g, accuracy: %g (running averages)",
+                                         datetime.now().isoformat(), last_iter, averages['loss'], averages['acc'])
+                    stop = False
+                    if validation is not None and early_stopping.due(step):
+                        validate(step)
+                        stop = early_stopping.should_stop
+                    profile.end_step(pipeline.size * len(devices))
+                    if stop:
+                        logging.info("No improvement in the last %s validations: stopping at step %d",
+                                     early_stopping.patience, step)
+                        break
+            except tf.errors.OutOfRangeError:
+                profile.cancel_step()
+            finally:
+                pipeline.stop(sess)
+                self.history.close()
+            if validation is not None and step and early_stopping.last_step != step:
+                validate(step)
+            if output_filename and (validation is None or early_stopping.best_step is None):
+                save()
+        self.train_averages = averages.to_json()
+        self.step_profile = profile
+        summary = profile.summary()
+        logging.info("Trained %s steps at %.1f examples/s; time (s) per phase: %s; max RSS %s kB", summary['n_steps'],
+                     summary['examples_per_second'], summary['seconds'], summary['max_rss_kb'])
+        return self.history
+
+    def load(self, checkpoint):
+        """Restore a trained model into a dedicated inference graph, kept open for `predict` until `close`."""
+        self.close()
+        graph = tf.Graph()
+        with graph.as_default():
+            self._x = self._input()
+            y_conv, variables = self._network(self._x)
+            self._y_pred = tf.argmax(y_conv, 1)
+            self._y_prob = tf.nn.softmax(y_conv)
+            # Only the network variables: the optimizer slots stored in the checkpoint are not needed for inference
+            saver = tf.train.Saver(variables)
+        graph.finalize()
+        self._sess = tf.Session(graph=graph)
+        saver.restore(self._sess, checkpoint)
+        logging.info("Successfully restored the model from %s", checkpoint)
+        return self
+
+    def close(self):
+        if self._sess is not None:
+            self._sess.close()
+            self._sess = None
+        return self
+
+    def _check_loaded(self):
+        if self._sess is None:
+            raise RuntimeError("%s must be loaded before calling predict" % self.__class__.__name__)
+
+    def predict_proba(self, samples, batch_size=256):
+        self._check_loaded()
+        return predict_batches(self._sess, [self._y_prob], self._x, np.asarray(samples), batch_size=batch_size)[0]
+
+    def predict(self, samples, batch_size=256):
+        self._check_loaded()
+        codes = predict_batches(self._sess, [self._y_pred], self._x, np.asarray(samples), batch_size=batch_size)[0]
+        return self.label_encoder.inverse_codes(codes)
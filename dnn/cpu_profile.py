@@ -0,0 +1,51 @@
+import multiprocessing
+
+import tensorflow as tf
+
+
+class CPUProfile(object):
+    """Thread pools and data-parallel replicas of the TensorFlow runtime on a CPU-only node."""
+
+    def __init__(self, intra_op_threads=0, inter_op_threads=0, replicas=1):
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.replicas = max(1, replicas)
+
+    @classmethod
+    def add_arguments(cls, parser, replicas=True):
+        parser.add_argument("--intra_op_threads", type=int, default=multiprocessing.cpu_count(),
+                            help="threads running each TensorFlow op (0 lets TensorFlow choose)")
+        parser.add_argument("--inter_op_threads", type=int, default=2,
+                            help="TensorFlow ops run concurrently (0 lets TensorFlow choose)")
+        if replicas:
+            parser.add_argument("--replicas", type=int, default=1,
+                                help="data-parallel replicas of the network averaging their gradients")
+        return parser
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(args.intra_op_threads, args.inter_op_threads, getattr(args, 'replicas', 1))
+
+    @property
+    def devices(self):
+        if self.replicas == 1:
+            return [None]
+        return ['/cpu:%d' % i for i in range(self.replicas)]
+
+    def config(self):
+        # Per-session thread pools: the global ones are sized once, by the first session of the process
+        return tf.ConfigProto(intra_op_parallelism_threads=self.intra_op_threads,
+                              inter_op_parallelism_threads=self.inter_op_threads,
+                              use_per_session_threads=True, device_count={'CPU': self.replicas},
+                              allow_soft_placement=True)
+
+    def session(self, graph=None):
+        return tf.Session(graph=graph, config=self.config())
+
+    def to_json(self):
+        return {'intra_op_threads': self.intra_op_threads, 'inter_op_threads': self.inter_op_threads,
+                'replicas': self.replicas}
+
+    def __repr__(self):
+        return "%s(intra_op_threads=%s, inter_op_threads=%s, replicas=%s)" % (
+            self.__class__.__name__, self.intra_op_threads, self.inter_op_threads, self.replicas)
@@ -0,0 +1,35 @@
+class EarlyStopping(object):
+    """Patience-based early stopping on a validation score (higher is better)."""
+
+    def __init__(self, eval_every=100, patience=10, min_delta=0.):
+        self.eval_every = eval_every
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best_score = None
+        self.best_step = None
+        self.last_step = None
+        self.n_evaluations = 0
+        self._n_stale = 0
+
+    def due(self, step):
+        return step % self.eval_every == 0
+
+    def update(self, step, score):
+        self.last_step = step
+        self.n_evaluations += 1
+        if self.best_score is None or score > self.best_score + self.min_delta:
+            self.best_score = score
+            self.best_step = step
+            self._n_stale = 0
+            return True
+        self._n_stale += 1
+        return False
+
+    @property
+    def should_stop(self):
+        return self._n_stale >= self.patience
+
+    def to_json(self):
+        return {'eval_every': self.eval_every, 'patience': self.patience, 'min_delta': self.min_delta,
+                'best_score': self.best_score, 'best_step': self.best_step, 'last_step': self.last_step,
+                'stopped_early': self.should_stop}
@@ -0,0 +1,12 @@
+import numpy as np
+
+
+def predict_batches(sess, fetches, x, samples, batch_size=256, feed_dict=None):
+    """Evaluate `fetches` on `samples` fed to `x` in slices of `batch_size` rows."""
+    feed_dict = dict(feed_dict or {})
+    outputs = [[] for _ in fetches]
+    for start in range(0, len(samples), batch_size):
+        feed_dict[x] = samples[start:start + batch_size]
+        for output, value in zip(outputs, sess.run(fetches, feed_dict=feed_dict)):
+            output.append(value)
+    return [np.concatenate(output) if output else np.array([]) for output in outputs]
@@ -0,0 +1,176 @@
+import threading
+import time
+
+import tensorflow as tf
+
+from dnn.metrics_recorder import RowStore
+
+
+class QueueInput(object):
+    """Batches of (samples, one-hot labels) dequeued inside the graph from a queue filled by background threads."""
+
+    def __init__(self, sample_shape, n_classes, capacity=8, n_threads=1, size=None, count_max=None):
+        self.sample_shape = tuple(sample_shape)
+        self.n_classes = n_classes
+        self.capacity = capacity
+        self.n_threads = n_threads
+        self.size = size
+        self.count_max = count_max
+        self._queue = None
+        self._enqueue = None
+        self._close = None
+        self._cancel = None
+        self._coord = None
+        self._threads = []
+        self._n_running = 0
+        self._lock = threading.Lock()
+        # One row per batch enqueued, preallocated for the whole run when its number of batches is known
+        self._ready_times = RowStore(('ready', ), capacity=count_max or 1024)
+
+    def _batch_tensors(self):
+        raise NotImplementedError
+
+    def _feeds(self, index):
+        raise NotImplementedError
+
+    def _initialize(self, sess):
+        pass
+
+    def _build(self):
+        if self._queue is None:
+            self._queue = tf.FIFOQueue(self.capacity, [tf.float32, tf.float32], name='input_queue')
+            self._enqueue = self._queue.enqueue(self._batch_tensors())
+            self._close = self._queue.close()
+            self._cancel = self._queue.close(cancel_pending_enqueues=True)
+        return self._queue
+
+    def dequeue(self):
+        """The (samples, labels) tensors of a batch; each call dequeues its own batch."""
+        samples, labels = self._build().dequeue()
+        samples.set_shape((None, ) + self.sample_shape)
+        labels.set_shape((None, self.n_classes))
+        return samples, labels
+
+    def _producer(self, sess, index):
+        close = self._close
+        try:
+            for feed_dict in self._feeds(index):
+                if self._coord.should_stop():
+                    break
+                sess.run(self._enqueue, feed_dict=feed_dict)
+                with self._lock:
+                    self._ready_times.append(ready=time.time())
+        except (tf.errors.OutOfRangeError, tf.errors.CancelledError, tf.errors.AbortedError):
+            # The queue was closed by `stop`
+            pass
+        except Exception as e:
+            self._coord.request_stop(e)
+            close = self._cancel
+        with self._lock:
+            self._n_running -= 1
+            if self._n_running and close is self._close:
+                return
+        try:
+            sess.run(close)
+        except tf.errors.OpError:
+            pass
+
+    def ready_time(self, index):
+        with self._lock:
+            return float(self._ready_times.rows[index, 0]) if index < len(self._ready_times) else None
+
+    def start(self, sess):
+        self._build()
+        self._initialize(sess)
+        self._coord = tf.train.Coordinator()
+        self._n_running = self.n_threads
+        self._threads = [threading.Thread(target=self._producer, args=(sess, index)) for index in range(self.n_threads)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def stop(self, sess):
+        if self._coord is None:
+            return self
+        self._coord.request_stop()
+        try:
+            sess.run(self._cancel)
+        except tf.errors.OpError:
+            pass
+        coord, self._coord = self._coord, None
+        coord.join(self._threads)
+        return self
+
+
+class FeedQueue(QueueInput):
+    """Queue filled from a `next_batch` callable, which returns (None, None) at the end of the data."""
+
+    def __init__(self, next_batch, sample_shape, n_classes, capacity=8, size=None, count_max=None):
+        super(FeedQueue, self).__init__(sample_shape, n_classes, capacity=capacity, n_threads=1, size=size,
+                                        count_max=count_max)
+        self._next_batch = next_batch
+        self._samples = None
+        self._labels = None
+
+    @classmethod
+    def from_batcher(cls, batcher, sample_shape, label_encoder, capacity=8):
+        def next_batch():
+            samples, labels = batcher.next_batch()
+            if samples is None:
+                return None, None
+            return samples, label_encoder.transform(labels)
+        return cls(next_batch, sample_shape, len(label_encoder.levels), capacity=capacity, size=batcher.size,
+                   count_max=batcher.count_max)
+
+    def _batch_tensors(self):
+        self._samples = tf.placeholder(tf.float32, shape=(None, ) + self.sample_shape)
+        self._labels = tf.placeholder(tf.float32, shape=[None, self.n_classes])
+        return self._samples, self._labels
+
+    def _feeds(self, index):
+        while True:
+            samples, labels = self._next_batch()
+            if samples is None:
+                return
+            yield {self._samples: samples, self._labels: labels}
+
+
+class BootstrapQueue(QueueInput):
+    """Bootstrap batches of a `BootstrapBatch` gathered and averaged inside the graph, from the queue's own trials."""
+
+    def __init__(self, bootstrap_batch, max_iter, label_encoder, n_threads=4, capacity=8):
+        super(BootstrapQueue, self).__init__(bootstrap_batch.arr.shape[1:], len(label_encoder.levels),
+                                             capacity=capacity, n_threads=n_threads,
+                                             size=bootstrap_batch._batch_size, count_max=max_iter)
+        self._bootstrap_batch = bootstrap_batch
+        self._label_encoder = label_encoder
+        self._drawn = 0
+        self._trials_array = bootstrap_batch.arr
+        self._trials_shape = bootstrap_batch.arr.shape
+        self._trials_value = None
+        self._trials = None
+        self._indices = None
+        self._labels = None
+
+    def _batch_tensors(self):
+        self._trials_value = tf.placeholder(tf.float32, shape=self._trials_shape)
+        # Out of the variable collections: neither initialized with the model nor saved in its checkpoints
+        self._trials = tf.Variable(self._trials_value, trainable=False, collections=[], name='trials')
+        self._indices = tf.placeholder(tf.int32, shape=[None, None])
+        self._labels = tf.placeholder(tf.float32, shape=[None, self.n_classes])
+        return tf.reduce_mean(tf.gather(self._trials, self._indices), 1), self._labels
+
+    def _initialize(self, sess):
+        sess.run(self._trials.initializer, feed_dict={self._trials_value: self._trials_array})
+        # The batches only need the indices from now on
+        self._trials_array = None
+
+    def _feeds(self, index):
+        while True:
+            with self._lock:
+                if self._drawn >= self.count_max:
+                    return
+                self._drawn += 1
+                indices, labels = self._bootstrap_batch.next_indices()
+            yield {self._indices: indices, self._labels: self._label_encoder.transform(labels)}
@@ -0,0 +1,134 @@
+import numpy as np
+
+
+def save_csv(f, rows, columns=None):
+    np.savetxt(f, rows, fmt='%.9g', delimiter=',', header=','.join(columns) if columns else '', comments='')
+
+
+class RowStore(object):
+    """Rows of named numeric columns in a preallocated array, grown geometrically."""
+
+    def __init__(self, columns, capacity=1024, growth=2.):
+        self.columns = tuple(columns)
+        self.column_index = {name: k for k, name in enumerate(self.columns)}
+        self.growth = growth
+        self._rows = np.empty((max(1, capacity), len(self.columns)))
+        self._n_rows = 0
+
+    def __len__(self):
+        return self._n_rows
+
+    def __getitem__(self, name):
+        return self._rows[:self._n_rows, self.column_index[name]]
+
+    @property
+    def rows(self):
+        return self._rows[:self._n_rows]
+
+    def append(self, **values):
+        unknown = set(values) - set(self.columns)
+        if unknown:
+            raise KeyError("Unknown columns: %s" % sorted(unknown))
+        if self._n_rows == len(self._rows):
+            rows = np.empty((int(len(self._rows) * self.growth) + 1, len(self.columns)))
+            rows[:self._n_rows] = self._rows[:self._n_rows]
+            self._rows = rows
+        row = self._rows[self._n_rows]
+        row.fill(np.nan)
+        for name, value in values.iteritems():
+            row[self.column_index[name]] = value
+        self._n_rows += 1
+        return row
+
+    def pop(self):
+        self._n_rows -= 1
+        return self._rows[self._n_rows]
+
+    def clear(self):
+        self._n_rows = 0
+        return self
+
+    def to_csv(self, file_name):
+        save_csv(file_name, self.rows, self.columns)
+        return file_name
+
+
+class MetricsRecorder(object):
+    """Training metrics, optionally flushed to a CSV file, with a downsampled summary."""
+
+    def __init__(self, columns, capacity=1024, growth=2., file_name=None, flush_every=1000, max_summary_points=500):
+        if file_name:
+            # At most `flush_every` rows are held in memory
+            capacity = min(capacity, flush_every)
+        self._store = RowStore(columns, capacity=capacity, growth=growth)
+        self.columns = self._store.columns
+        self.file_name = file_name
+        self.flush_every = flush_every
+        self.max_summary_points = max_summary_points
+        self._summary = np.empty((max_summary_points + 1, len(self.columns)))
+        self._n_summary = 0
+        self._last = np.full(len(self.columns), np.nan)
+        self.stride = 1
+        self.n_records = 0
+        self.n_flushed = 0
+        if file_name:
+            with open(file_name, 'w') as f:
+                f.write(','.join(self.columns) + '\n')
+
+    def __len__(self):
+        return self.n_records
+
+    def __getitem__(self, name):
+        return self.rows[:, self._store.column_index[name]]
+
+    @property
+    def rows(self):
+        """Every record, with the ones already flushed read back from `file_name`."""
+        if not self.n_flushed:
+            return self._store.rows
+        flushed = np.loadtxt(self.file_name, delimiter=',', skiprows=1, ndmin=2)[:self.n_flushed]
+        return np.vstack([flushed, self._store.rows])
+
+    def append(self, **values):
+        row = self._store.append(**values)
+        self._last[:] = row
+        if self.n_records % self.stride == 0:
+            self._add_summary_row(row)
+        self.n_records += 1
+        if self.file_name and len(self._store) >= self.flush_every:
+            self.flush()
+        return self
+
+    def _add_summary_row(self, row):
+        self._summary[self._n_summary] = row
+        self._n_summary += 1
+        if self._n_summary > self.max_summary_points:
+            # Keep the records that are multiples of the doubled stride
+            kept = self._summary[:self._n_summary:2].copy()
+            self._summary[:len(kept)] = kept
+            self._n_summary = len(kept)
+            self.stride *= 2
+
+    def flush(self):
+        if self.file_name and len(self._store):
+            with open(self.file_name, 'a') as f:
+                save_csv(f, self._store.rows)
+            self.n_flushed += len(self._store)
+            self._store.clear()
+        return self
+
+    def close(self):
+        return self.flush()
+
+    def to_csv(self, file_name):
+        save_csv(file_name, self.rows, self.columns)
+        return file_name
+
+    @staticmethod
+    def _to_list(values):
+        return [None if np.isnan(v) else float(v) for v in values]
+
+    def summary(self):
+        return {'n_records': self.n_records, 'stride': self.stride, 'file_name': self.file_name,
+                'last': dict(zip(self.columns, self._to_list(self._last))),
+                'rows': {name: self._to_list(self._summary[:self._n_summary, k]) for k, name in enumerate(self.columns)}}
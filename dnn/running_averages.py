@@ -0,0 +1,22 @@
+class RunningAverages(object):
+    """Bias-corrected exponential moving averages of scalar training statistics."""
+
+    def __init__(self, decay=0.99):
+        self.decay = decay
+        self._averages = dict()
+        self._counts = dict()
+
+    def update(self, **values):
+        for name, value in values.iteritems():
+            self._averages[name] = self.decay * self._averages.get(name, 0.) + (1. - self.decay) * float(value)
+            self._counts[name] = self._counts.get(name, 0) + 1
+        return self
+
+    def __contains__(self, name):
+        return name in self._averages
+
+    def __getitem__(self, name):
+        return self._averages[name] / (1. - self.decay ** self._counts[name])
+
+    def to_json(self):
+        return {name: self[name] for name in self._averages}
@@ -0,0 +1,125 @@
+import json
+import resource
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from dnn.metrics_recorder import RowStore, save_csv
+
+
+def max_rss():
+    """High-water mark of the resident memory of the process, in kB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class StepProfile(object):
+    """Wall time spent in each phase of the training steps, with their examples and memory high-water mark."""
+
+    PHASES = ('data', 'compute', 'logging', 'validation', 'checkpoint')
+    COLUMNS = ('start', ) + PHASES + ('examples', 'max_rss_kb')
+
+    def __init__(self, capacity=1024):
+        self._steps = RowStore(self.COLUMNS, capacity=capacity)
+        self._phases = slice(1, 1 + len(self.PHASES))
+        self._open = False
+        self.start_time = time.time()
+
+    @property
+    def n_steps(self):
+        return len(self._steps) - self._open
+
+    def start_step(self):
+        self.cancel_step()
+        self._steps.append(start=time.time(), examples=0, max_rss_kb=0, **dict.fromkeys(self.PHASES, 0.))
+        self._open = True
+        return self
+
+    def end_step(self, n_examples):
+        row = self._steps.rows[-1]
+        row[self._steps.column_index['examples']] = n_examples
+        row[self._steps.column_index['max_rss_kb']] = max_rss()
+        self._open = False
+        return self
+
+    def cancel_step(self):
+        if self._open:
+            self._steps.pop()
+        self._open = False
+        return self
+
+    def add(self, phase, seconds):
+        if len(self._steps):
+            self._steps.rows[-1, self._steps.column_index[phase]] += seconds
+        return self
+
+    def add_run(self, start, end, ready_time=None):
+        """Split the time of a `session.run` into data wait, until `ready_time`, and compute."""
+        ready_time = end if ready_time is None else ready_time
+        wait = min(max(ready_time - start, 0.), end - start)
+        return self.add('data', wait).add('compute', end - start - wait)
+
+    @contextmanager
+    def phase(self, phase):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(phase, time.time() - start)
+
+    @property
+    def starts(self):
+        return self._steps['start'][:self.n_steps] - self.start_time
+
+    @property
+    def durations(self):
+        return self._steps.rows[:self.n_steps, self._phases]
+
+    @property
+    def examples(self):
+        return self._steps['examples'][:self.n_steps]
+
+    @property
+    def max_rss_kb(self):
+        return self._steps['max_rss_kb'][:self.n_steps]
+
+    @property
+    def examples_per_second(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.durations.sum(axis=1) > 0, self.examples / self.durations.sum(axis=1), 0.)
+
+    def summary(self):
+        durations = self.durations
+        wall_time = durations.sum()
+        return {'n_steps': self.n_steps, 'n_examples': int(self.examples.sum()),
+                'seconds': dict(zip(self.PHASES, durations.sum(axis=0).tolist())),
+                'examples_per_second': float(self.examples.sum() / wall_time) if wall_time else 0.,
+                'max_rss_kb': int(self.max_rss_kb.max()) if self.n_steps else max_rss()}
+
+    def to_csv(self, file_name):
+        rows = np.column_stack([np.arange(1, self.n_steps + 1), self.starts, self.durations, self.examples,
+                                self.examples_per_second, self.max_rss_kb])
+        save_csv(file_name, rows, ('step', 'start') + self.PHASES + ('examples', 'examples_per_second', 'max_rss_kb'))
+        return file_name
+
+    def to_chrome_trace(self, file_name):
+        """Timeline of the steps for chrome://tracing."""
+        events = []
+        durations = self.durations
+        offsets = np.cumsum(np.column_stack([np.zeros(self.n_steps), durations[:, :-1]]), axis=1)
+        starts = 1e6 * (self.starts[:, np.newaxis] + offsets)
+        examples_per_second = self.examples_per_second
+        max_rss_kb = self.max_rss_kb
+        for step in range(self.n_steps):
+            for k, phase in enumerate(self.PHASES):
+                if durations[step, k] > 0:
+                    events.append({'name': phase, 'cat': 'train', 'ph': 'X', 'pid': 0, 'tid': 0,
+                                   'ts': starts[step, k], 'dur': 1e6 * durations[step, k],
+                                   'args': {'step': step + 1}})
+            events.append({'name': 'examples/s', 'ph': 'C', 'pid': 0, 'ts': starts[step, 0],
+                           'args': {'examples/s': float(examples_per_second[step])}})
+            events.append({'name': 'max_rss_kb', 'ph': 'C', 'pid': 0, 'ts': starts[step, 0],
+                           'args': {'max_rss_kb': int(max_rss_kb[step])}})
+        with open(file_name, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return file_name
@@ -7,13 +7,14 @@ import tensorflow as tf
 
 from data_tools.batch_manager import BatchManager
 from data_tools.data_saver import DataSaver
+from dnn.inference import predict_batches
 from utils.logging_utils import logging_reconfig
 
 
 logging_reconfig()
 
 
-def train(input_uid):
+def train(input_uid, batch_size=256):
     def weight_variable(shape, name):
         initial = tf.truncated_normal(shape, stddev=0.1)
         return tf.Variable(initial, name=name)
@@ -87,6 +88,9 @@ def train(input_uid):
 
     # implements the convolutional model
     y_conv = tf.matmul(h_fc1_drop, W_fc2) + b_fc2
+    # prediction ops are built once and evaluated on whole slices of the test set
+    y_pred = tf.argmax(y_conv, 1)
+    y_prob = tf.nn.softmax(y_conv)
 
     sess = tf.Session()
     saver = tf.train.Saver()
@@ -94,19 +98,24 @@ def train(input_uid):
     result.update({'input_uid': input_uid, 'batch_size': bm.batch_size})
     with sess.as_default():
         try:
-            saver.restore(sess, "/home/claudio/Projects/eeg_vision/scripts/model_%s.ckpt" % db_uid)
+            saver.restore(sess, "/home/claudio/Projects/eeg_vision/scripts/model_%s.ckpt" % input_uid)
             logging.info("Successfully restored model from the DB")
         except Exception as e:
             logging.info("Failed to restore model from the DB: %s", e)
             sys.exit(0)
-        test_classification = []
+        true_labels, predictions, probabilities = [], [], []
         while bm.next_test():
-            test_classification += [(int(np.argmax(bm.labels('test')[n])),
-                                     int(sess.run(tf.argmax(y_conv, 1), feed_dict={
-                                         x: bm.samples('test')[n, :, :, :][None, :, :, :], keep_prob: 1.0})))
-                                    for n in range(bm.samples('test').shape[0])]
-        test_accuracy = float(np.mean([int(a == b) for a, b in test_classification]))
-        result.update({'test_accuracy': test_accuracy, 'test_classification': json.dumps(test_classification)})
+            pred, prob = predict_batches(sess, [y_pred, y_prob], x, bm.samples('test'), batch_size=batch_size,
+                                         feed_dict={keep_prob: 1.0})
+            true_labels.append(np.argmax(bm.labels('test'), axis=1))
+            predictions.append(pred)
+            probabilities.append(prob)
+        true_labels = np.concatenate(true_labels)
+        predictions = np.concatenate(predictions)
+        test_accuracy = float(np.mean(true_labels == predictions))
+        test_classification = zip(true_labels.tolist(), predictions.tolist())
+        result.update({'test_accuracy': test_accuracy, 'test_classification': json.dumps(test_classification),
+                       'test_probabilities': json.dumps(np.concatenate(probabilities).tolist())})
         logging.info("test accuracy %g", test_accuracy)
     return result
 
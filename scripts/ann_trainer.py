@@ -5,12 +5,17 @@ import sys
 import traceback
 
 import deepdish as dd
+import numpy as np
 from funcy import merge
-from pymongo import MongoClient
+from sklearn.cross_validation import train_test_split
 
 import settings
+from base.mongo_io import ensure_indexes, get_client
 from data_tools.bootstrap_batch import BootstrapBatch
 from dnn.convnet import ConvNet
+from dnn.cpu_profile import CPUProfile
+from dnn.early_stopping import EarlyStopping
+from dnn.input_pipeline import BootstrapQueue
 from utils.logging_utils import logging_reconfig
 
 
@@ -27,11 +32,31 @@ if __name__ == '__main__':
     parser.add_argument("--batch_count", type=int, default=20000)
     parser.add_argument("--batch_size", type=int, default=50)
     parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--prefetch", type=int, default=4, help="number of batches prepared ahead of training")
+    parser.add_argument("--input_threads", type=int, default=4,
+                        help="number of threads averaging the bootstrap batches in the graph")
+    parser.add_argument("--batch_files", action="store_true",
+                        help="write the bootstrap batches to temporary files instead of generating them in the graph")
+    parser.add_argument("--single_file", action="store_true",
+                        help="with --batch_files, write all the batches into a single container file")
+    parser.add_argument("--validation_proportion", type=float, default=0.1,
+                        help="proportion of the trials held out for early stopping (0 trains on all the batches)")
+    parser.add_argument("--validation_batches", type=int, default=20,
+                        help="number of bootstrap batches of the held-out trials in the validation set")
+    parser.add_argument("--eval_every", type=int, default=100, help="training steps between validations")
+    parser.add_argument("--patience", type=int, default=10,
+                        help="validations without improvement before training stops")
+    parser.add_argument("--history_output", type=str, default=None,
+                        help="CSV file of the per-step training metrics (defaults to <model_output>.history.csv)")
+    parser.add_argument("--profile_output", type=str, default=None,
+                        help="prefix of the per-step timings exported as <prefix>.csv and <prefix>.trace.json")
+    CPUProfile.add_arguments(parser)
     args = parser.parse_args()
+    cpu_profile = CPUProfile.from_args(args)
 
     logging.info("Starting to train the CNN model for Brainwave Classification")
-    client = MongoClient('localhost', 27017)
-    db = client.brain
+    client = get_client('localhost', 27017)
+    db = ensure_indexes(client.brain)
 
     train_info = db.train_info.find_one({'subject': args.subject})
     if not train_info:
@@ -52,37 +77,74 @@ if __name__ == '__main__':
         logging.info("Failed to load the data: %s", e)
         sys.exit(0)
 
-    logging.info("Creating temporary batch files")
-    try:
-        work_dir = os.path.join(os.path.dirname(train_info['path']), "batches")
-        batcher = BootstrapBatch(data['samples'], data['labels'], args.group_size_max, args.batch_size, seed=args.seed,
-                                 auto_remove_files=True)\
-            .create(args.batch_count, work_dir, prefix='%s_train_' % train_info['subject'])
-        logging.info("Successfully created the batch files")
-    except Exception as e:
-        logging.info("Failed to create the batch files: %s", e)
-        sys.exit(0)
-
-    del data
-    gc.collect()
-
-    logging.info("Starting to train the neural network")
     conv_net = ConvNet(ann_config['W_conv1'], ann_config['bias_conv1'], ann_config['W_conv2'], ann_config['bias_conv2'],
                        ann_config['W_fc1'], ann_config['bias_fc1'], ann_config['W_fc2'], ann_config['bias_fc2'],
                        train_info['trial_size'], train_info['n_comps'], train_info['n_channels'],
                        train_info['n_classes'], learning_rate=ann_config['learning_rate'], )
-    conv_net.train(batcher, output_filename=args.model_output)
+    samples, labels = data['samples'], data['labels']
+    validation = None
+    if args.validation_proportion:
+        train_index, val_index = train_test_split(np.arange(len(labels)), test_size=args.validation_proportion,
+                                                  random_state=args.seed)
+        labels = np.asarray(labels)
+        # Bootstrap batches of the held-out trials, with the same group sizes as the training batches
+        val_batch = BootstrapBatch(samples[val_index], labels[val_index], args.group_size_max, args.batch_size,
+                                   seed=args.seed + 1)
+        val_batches = [val_batch.next_samples() for _ in range(args.validation_batches)]
+        validation = (np.concatenate([b[0] for b in val_batches]), sum([b[1] for b in val_batches], []))
+        samples, labels = samples[train_index], labels[train_index].tolist()
+        logging.info("Holding out %s trials for validation", len(val_index))
+        del val_batch, val_batches
+    bootstrap_batch = BootstrapBatch(samples, labels, args.group_size_max, args.batch_size,
+                                     seed=args.seed, auto_remove_files=True)
+    if args.batch_files:
+        logging.info("Creating temporary batch files")
+        try:
+            work_dir = os.path.join(os.path.dirname(train_info['path']), "batches")
+            batcher = bootstrap_batch.create(args.batch_count, work_dir, prefix='%s_train_' % train_info['subject'],
+                                             prefetch=args.prefetch, single_file=args.single_file)
+            logging.info("Successfully created the batch files")
+        except Exception as e:
+            logging.info("Failed to create the batch files: %s", e)
+            sys.exit(0)
+    else:
+        logging.info("Generating the bootstrap batches in the graph")
+        batcher = BootstrapQueue(bootstrap_batch, args.batch_count, conv_net.label_encoder,
+                                 n_threads=args.input_threads, capacity=args.prefetch)
+        # The queue holds the trials until they are copied into the graph
+        bootstrap_batch.release_trials()
+
+    del data, samples, labels, bootstrap_batch
+    gc.collect()
+
+    logging.info("Starting to train the neural network")
+    early_stopping = EarlyStopping(eval_every=args.eval_every, patience=args.patience)
+    conv_net.train(batcher, output_filename=args.model_output, cpu_profile=cpu_profile, validation=validation,
+                   early_stopping=early_stopping, history_file=args.history_output or args.model_output + '.history.csv')
+    step_profile = conv_net.step_profile.summary()
+    if args.profile_output:
+        step_profile['csv'] = conv_net.step_profile.to_csv(args.profile_output + '.csv')
+        step_profile['trace'] = conv_net.step_profile.to_chrome_trace(args.profile_output + '.trace.json')
+        logging.info("Exported the step timings to %s and %s", step_profile['csv'], step_profile['trace'])
 
     try:
         ann_config.pop("_id")
-        doc = merge(ann_config, {"train_accuracy": conv_net.train_accuracy, "path": args.model_output,
+        doc = merge(ann_config, {"train_history": conv_net.history.summary(), "train_averages": conv_net.train_averages,
+                                 "path": args.model_output,
                                  "batch_size": args.batch_size, "group_size_max": args.group_size_max,
-                                 "seed": args.seed, "batch_count": args.batch_count})
+                                 "seed": args.seed, "batch_count": args.batch_count,
+                                 "trial_size": train_info['trial_size'], "n_comps": train_info['n_comps'],
+                                 "n_channels": train_info['n_channels'], "n_classes": train_info['n_classes'],
+                                 "cpu_profile": cpu_profile.to_json(), "step_profile": step_profile,
+                                 "validation_proportion": args.validation_proportion,
+                                 "validation_history": conv_net.validation_history.summary(),
+                                 "early_stopping": early_stopping.to_json() if validation is not None else None})
         doc = db.trained_models.insert_one(doc)
-        logging.info("Successfully created the database entry %s for the result", doc['_id'])
+        logging.info("Successfully created the database entry %s for the result", doc.inserted_id)
     except Exception, e:
         logging.info("Failed to create a database entry for the result:\n%s\n%s", e, traceback.format_exc())
     finally:
-        batcher.remove_batch_files()
-        logging.info("Successfully deleted the temporary batch files from the disc")
+        if args.batch_files:
+            batcher.remove_batch_files()
+            logging.info("Successfully deleted the temporary batch files from the disc")
     logging.info("Finished to train the model")
@@ -19,8 +19,9 @@ if __name__ == '__main__':
     parser.add_argument("-d", "--derivation", type=str, choices=settings.DERIVATIONS, default=DEFAULT_DERIVATION,
                         help="EEG derivation to be used")
     parser.add_argument("--seed", type=int, default=42, help="seed to set the random generator's state")
+    parser.add_argument("--single_file", action="store_true", help="write all the training batches into one file")
     args = parser.parse_args()
     work_dir = "/home/claudio/Projects/brain_data/vision/batches"
     bc = BatchCreator(args.subject, args.batch_size, args.avg_group_size, args.derivation, args.test_proportion,
                       args.workdir, seed=args.seed)
-    bc.create(args.iter_max)
+    bc.create(args.iter_max, single_file=args.single_file)
@@ -0,0 +1,69 @@
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from data_tools.bootstrap_batch import BootstrapBatch
+from dnn.cpu_profile import CPUProfile
+from dnn.input_pipeline import BootstrapQueue
+from scripts.benchmark_input_pipeline import create_conv_net
+
+
+def cpu_profile(s):
+    try:
+        values = map(int, s.split(','))
+        return CPUProfile(*values)
+    except (ValueError, TypeError):
+        raise argparse.ArgumentTypeError("Expecting INTRA,INTER[,REPLICAS] but got '%s'" % s)
+
+
+def examples_rate(conv_net, bootstrap_batch, profile, n_steps, warmup, input_threads):
+    """Training examples per second of ConvNet with the given execution profile."""
+    devices = profile.devices
+    pipeline = BootstrapQueue(bootstrap_batch, (warmup + n_steps) * len(devices), conv_net.label_encoder,
+                              n_threads=input_threads)
+    with tf.Graph().as_default():
+        keep_prob, _, train_step, _ = conv_net._training([pipeline.dequeue() for _ in devices], devices)
+        with profile.session() as sess:
+            sess.run(tf.initialize_all_variables())
+            pipeline.start(sess)
+            try:
+                for i in range(warmup + n_steps):
+                    if i == warmup:
+                        start = time.time()
+                    sess.run(train_step, feed_dict={keep_prob: 0.5})
+            finally:
+                pipeline.stop(sess)
+            return n_steps * len(devices) * pipeline.size / (time.time() - start)
+
+
+if __name__ == '__main__':
+    n_cpus = multiprocessing.cpu_count()
+    parser = argparse.ArgumentParser(description="Training examples per second of ConvNet for several CPU execution "
+                                                 "profiles, on synthetic trials")
+    parser.add_argument("profiles", type=cpu_profile, nargs="*",
+                        default=[CPUProfile(), CPUProfile(n_cpus, 2), CPUProfile(n_cpus // 2, 2, 2),
+                                 CPUProfile(n_cpus // 4, 4, 4)],
+                        help="INTRA,INTER[,REPLICAS] thread counts (0 lets TensorFlow choose)")
+    parser.add_argument("--n_trials", type=int, default=5188)
+    parser.add_argument("--n_channels", type=int, default=124)
+    parser.add_argument("--trial_size", type=int, default=32)
+    parser.add_argument("--group_size_max", type=int, default=10)
+    parser.add_argument("--batch_size", type=int, default=50)
+    parser.add_argument("--n_steps", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--input_threads", type=int, default=4)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(42)
+    trials = rng.randn(args.n_trials, args.n_channels, args.trial_size, 3).astype(np.float32)
+    labels = rng.randint(1, 7, args.n_trials).tolist()
+    conv_net = create_conv_net(args.n_channels, args.trial_size)
+
+    print "%s CPUs" % n_cpus
+    for profile in args.profiles:
+        bootstrap_batch = BootstrapBatch(trials, labels, args.group_size_max, args.batch_size)
+        rate = examples_rate(conv_net, bootstrap_batch, profile, args.n_steps, args.warmup, args.input_threads)
+        print "%s: %.1f examples/s" % (profile, rate)
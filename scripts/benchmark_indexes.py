@@ -0,0 +1,58 @@
+import argparse
+import random
+import timeit
+
+import settings
+from base.mongo_io import MongoIO, ensure_indexes
+
+BENCHMARK_COLLECTION = 'coll_index_benchmark'
+
+
+def time_lookups(coll, queries, repeat):
+    def run():
+        for criteria in queries:
+            list(coll.find(criteria, {'_id': True}))
+    return min(timeit.repeat(run, number=1, repeat=repeat)) / len(queries)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Lookup latency on the accuracy collection with and without the "
+                                                 "indexes declared in settings.MONGO_INDEXES")
+    parser.add_argument("--host", type=str, default=settings.MONGO_DEFAULT['host'])
+    parser.add_argument("--port", type=int, default=settings.MONGO_DEFAULT['port'])
+    parser.add_argument("--n_docs", type=int, default=200000)
+    parser.add_argument("--n_queries", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--mongomock", action="store_true", help="use an in-memory mongomock client")
+    args = parser.parse_args()
+
+    if args.mongomock:
+        import mongomock
+        db = mongomock.MongoClient()[settings.MONGO_DB]
+    else:
+        db = MongoIO(host=args.host, port=args.port).db
+    coll = db[BENCHMARK_COLLECTION]
+    coll.drop()
+
+    random.seed(42)
+    clf_ids = ['clf_%s' % k for k in range(40)]
+    docs = [{'subject': random.choice(settings.SUBJECTS), 'group_size': random.choice([0, 5, 10]),
+             'clf_id': random.choice(clf_ids), 'dataset': 'channel_%s' % random.randint(1, 124),
+             'accuracy': random.random()} for _ in range(args.n_docs)]
+    for start in range(0, len(docs), 10000):
+        coll.insert_many(docs[start:start + 10000])
+    queries = [{'subject': random.choice(settings.SUBJECTS), 'group_size': random.choice([0, 5, 10]),
+                'clf_id': random.choice(clf_ids)} for _ in range(args.n_queries)]
+    subject_queries = [{'subject': q['subject'], 'group_size': q['group_size']} for q in queries]
+    clf_queries = [{'clf_id': q['clf_id']} for q in queries]
+
+    try:
+        no_index = (time_lookups(coll, subject_queries, args.repeat), time_lookups(coll, clf_queries, args.repeat))
+        ensure_indexes(db, [BENCHMARK_COLLECTION],
+                       indexes={BENCHMARK_COLLECTION: settings.MONGO_INDEXES[settings.MONGO_ACC_COLLECTION]})
+        indexed = (time_lookups(coll, subject_queries, args.repeat), time_lookups(coll, clf_queries, args.repeat))
+        print "%s documents, mean latency per lookup (ms)" % args.n_docs
+        print "(subject, group_size): %.3f without index, %.3f with index" % (1e3 * no_index[0], 1e3 * indexed[0])
+        print "clf_id: %.3f without index, %.3f with index" % (1e3 * no_index[1], 1e3 * indexed[1])
+    finally:
+        coll.drop()
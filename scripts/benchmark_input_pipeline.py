@@ -0,0 +1,83 @@
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from data_tools.bootstrap_batch import BootstrapBatch
+from dnn.convnet import ConvNet
+from dnn.input_pipeline import BootstrapQueue
+
+
+def create_conv_net(n_channels, trial_size, n_comps=3, n_classes=6):
+    # Same layers as the 'ann_simple' configuration, sized for the synthetic trials
+    fc_size = int(np.ceil(n_channels / 4.)) * int(np.ceil(trial_size / 4.)) * 64
+    return ConvNet([5, 5, n_comps, 32], [32], [5, 5, 32, 64], [64], [fc_size, 1024], [1024], [1024, n_classes],
+                   [n_classes], trial_size, n_comps, n_channels, n_classes)
+
+
+def feed_dict_rate(conv_net, bootstrap_batch, n_steps, warmup):
+    """Steps per second when every batch is averaged in numpy and copied into the step with `feed_dict`."""
+    with tf.Graph().as_default():
+        x = conv_net._input()
+        y_ = tf.placeholder(tf.float32, shape=[None, conv_net.n_classes])
+        keep_prob, _, train_step, _ = conv_net._training([(x, y_)])
+        with tf.Session() as sess:
+            sess.run(tf.initialize_all_variables())
+            for i in range(warmup + n_steps):
+                if i == warmup:
+                    start = time.time()
+                samples, labels = bootstrap_batch.next_samples()
+                sess.run(train_step, feed_dict={x: samples, y_: conv_net.label_encoder.transform(labels),
+                                                keep_prob: 0.5})
+            return n_steps / (time.time() - start)
+
+
+def pipeline_rate(conv_net, pipeline, n_steps, warmup):
+    """Steps per second when the batches are dequeued inside the graph."""
+    with tf.Graph().as_default():
+        keep_prob, _, train_step, _ = conv_net._training([pipeline.dequeue()])
+        with tf.Session() as sess:
+            sess.run(tf.initialize_all_variables())
+            pipeline.start(sess)
+            try:
+                for i in range(warmup + n_steps):
+                    if i == warmup:
+                        start = time.time()
+                    sess.run(train_step, feed_dict={keep_prob: 0.5})
+            finally:
+                pipeline.stop(sess)
+            return n_steps / (time.time() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the training steps per second of ConvNet fed with feed_dict "
+                                                 "against the queue-based input pipelines, on synthetic trials")
+    parser.add_argument("--n_trials", type=int, default=5188)
+    parser.add_argument("--n_channels", type=int, default=124)
+    parser.add_argument("--trial_size", type=int, default=32)
+    parser.add_argument("--group_size_max", type=int, default=10)
+    parser.add_argument("--batch_size", type=int, default=50)
+    parser.add_argument("--n_steps", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--input_threads", type=int, nargs="*", default=[1, 4])
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(42)
+    trials = rng.randn(args.n_trials, args.n_channels, args.trial_size, 3).astype(np.float32)
+    labels = rng.randint(1, 7, args.n_trials).tolist()
+    conv_net = create_conv_net(args.n_channels, args.trial_size)
+    n_batches = args.warmup + args.n_steps
+
+    def bootstrap_batch():
+        return BootstrapBatch(trials, labels, args.group_size_max, args.batch_size)
+
+    baseline = feed_dict_rate(conv_net, bootstrap_batch(), args.n_steps, args.warmup)
+    print "feed_dict: %.2f steps/s" % baseline
+    pipeline = conv_net.input_pipeline(bootstrap_batch().stream(n_batches, prefetch=4))
+    rate = pipeline_rate(conv_net, pipeline, args.n_steps, args.warmup)
+    print "FeedQueue: %.2f steps/s (%.2fx)" % (rate, rate / baseline)
+    for n_threads in args.input_threads:
+        pipeline = BootstrapQueue(bootstrap_batch(), n_batches, conv_net.label_encoder, n_threads=n_threads)
+        rate = pipeline_rate(conv_net, pipeline, args.n_steps, args.warmup)
+        print "BootstrapQueue, %s threads: %.2f steps/s (%.2fx)" % (n_threads, rate, rate / baseline)
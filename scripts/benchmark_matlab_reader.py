@@ -0,0 +1,57 @@
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+import numpy as np
+from scipy.io import loadmat, savemat
+
+from data_tools.matlab_data_reader import matlab_data_reader, deinterleave_channels
+
+
+def legacy_deinterleave(data, trial_size):
+    n_trials, n = data.shape
+    n_channels = n // trial_size
+    return np.array([data[:, k * trial_size:][:, :trial_size].ravel() for k in range(n_channels)])
+
+
+def create_mat_file(path, n_trials, n_channels, trial_size, seed=42):
+    rng = np.random.RandomState(seed)
+    with open(os.path.join(path, "elect.csv"), "w") as f:
+        f.write("label,x,y,z\n")
+        for k in range(n_channels):
+            f.write("E%s,%s,%s,%s\n" % tuple([k + 1] + rng.rand(3).tolist()))
+    file_name = os.path.join(path, "S1.mat")
+    savemat(file_name, {'X': rng.randn(n_trials, n_channels * trial_size), 'N': trial_size, 'Fs': 62.5, 'sub': 1,
+                        'categoryLabels': rng.randint(1, 7, n_trials)})
+    return file_name
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the vectorized channel de-interleaving against the legacy "
+                                                 "list comprehension on a synthetic file with the shape of S1")
+    parser.add_argument("--n_trials", type=int, default=5188)
+    parser.add_argument("--n_channels", type=int, default=124)
+    parser.add_argument("--trial_size", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        mat_file = create_mat_file(work_dir, args.n_trials, args.n_channels, args.trial_size)
+        x = np.random.randn(args.n_trials, args.n_channels * args.trial_size)
+        assert np.array_equal(legacy_deinterleave(x, args.trial_size), deinterleave_channels(x, args.trial_size)), \
+            "The vectorized de-interleaving does not match the legacy output"
+        reader_data = matlab_data_reader(mat_file)['data'][:, :, 0]
+        assert np.array_equal(reader_data, legacy_deinterleave(loadmat(mat_file)['X'], args.trial_size)), \
+            "matlab_data_reader does not match the legacy output"
+        print "Equivalence check passed"
+        t_legacy = min(timeit.repeat(lambda: legacy_deinterleave(x, args.trial_size), number=1, repeat=args.repeat))
+        t_new = min(timeit.repeat(lambda: deinterleave_channels(x, args.trial_size), number=1, repeat=args.repeat))
+        print "legacy de-interleaving: %.4fs" % t_legacy
+        print "vectorized de-interleaving: %.4fs (%.1fx)" % (t_new, t_legacy / t_new)
+        t_reader = min(timeit.repeat(lambda: matlab_data_reader(mat_file), number=1, repeat=args.repeat))
+        print "matlab_data_reader: %.4fs" % t_reader
+    finally:
+        shutil.rmtree(work_dir)
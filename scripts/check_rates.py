@@ -1,3 +1,5 @@
+import sys
+
 import settings
 from base.mongo_io import MongoIO
 
@@ -8,10 +10,19 @@ if __name__ == '__main__':
 
     pd.set_option("display.width", 10000)
 
-    data = MongoIO(collection=settings.MONGO_ACC_COLLECTION).load(return_cursor=False)
-    clf = MongoIO(collection=settings.MONGO_CLF_COLLECTION).load(return_cursor=False)
-    clf_id2name = dict(pd.DataFrame(clf)[['_id', 'classifier']].values.tolist())
-    data = pd.DataFrame(data)
+    clf = MongoIO(collection=settings.MONGO_CLF_COLLECTION).load_dataframe(projection={'_id': True, 'classifier': True})
+    clf_id2name = dict(clf[['_id', 'classifier']].values.tolist())
+
+    # Reduce each batch to the best accuracy per group, so that memory does not grow with the size of the collection
+    keys = ['subject', 'derivation', 'clf_id']
+    projection = {'_id': False, 'subject': True, 'derivation': True, 'clf_id': True, 'accuracy': True}
+    data = None
+    for batch in MongoIO(collection=settings.MONGO_ACC_COLLECTION).load_dataframes(projection=projection):
+        if data is not None:
+            batch = pd.concat([data, batch], ignore_index=True)
+        data = batch.groupby(keys, as_index=False)['accuracy'].max()
+    if data is None:
+        sys.exit("No classification results in the collection %s" % settings.MONGO_ACC_COLLECTION)
     data['classifier'] = data['clf_id'].apply(lambda x: clf_id2name[x])
     data['method'] = data.apply(lambda x: '%s_%s' % (x['derivation'], x['classifier'][:-10]), axis=1)
     max_rates = data.pivot_table(index='subject', columns='method', values='accuracy', aggfunc='max')
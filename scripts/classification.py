@@ -1,14 +1,17 @@
 import argparse
 import logging
+from itertools import imap
+from multiprocessing import Pool
 
-from brainpy.eeg import EEG
 from funcy import merge
 
 import settings
+from base.mongo_io import MongoIO
 from classify.classifiers import LDAClassifier, SVMClassifier, LRClassifier, RFClassifier
-from data_tools.matlab_data_reader import matlab_data_reader
 from data_tools.data_saver import DataSaver
 from data_tools.data_tools import train_test_dataset
+from data_tools.derivation_cache import DerivationCache, file_digest, read_derived_eeg
+from data_tools.trial_store import convert_matlab_file, has_trial_store
 from utils.logging_utils import logging_reconfig
 
 logging_reconfig()
@@ -22,12 +25,57 @@ CLASSIFIERS = \
     }
 
 
+# Built from the inputs of the EEG rather than its doc, which depends on how the EEG was read
+RESULT_KEY = ('subject', 'dataset', 'derivation', 'group_size', 'lambda_value', 'file_digest', 'clf_id')
+
+
+def result_key(doc):
+    return tuple(doc[k] for k in RESULT_KEY)
+
+
+def completed_keys(collection, subject, group_size):
+    """Keys of the results already saved for a subject, fetched with a single query."""
+    projection = dict.fromkeys(RESULT_KEY, True)
+    cursor = MongoIO(collection=collection).load(return_cursor=True, projection=projection,
+                                                 criteria={'subject': subject, 'group_size': group_size})
+    return set(result_key(doc) for doc in cursor if all(k in doc for k in RESULT_KEY))
+
+
 def valid_proportion(p):
     if not isinstance(p, float) or p <= 0 or p >= 1:
         raise argparse.ArgumentTypeError("Proportion must be a float number greater than 0 and less than 1")
     return p
 
 
+_loaded_eeg = dict()
+
+
+def load_eeg(filename, derivation, lambda_value, group_size, cache_key=None):
+    """Keep the EEG of the current (subject, derivation) loaded in this process."""
+    key = (filename, derivation, lambda_value, group_size)
+    if key not in _loaded_eeg:
+        _loaded_eeg.clear()
+        _loaded_eeg[key] = read_derived_eeg(filename, derivation, lambda_value=lambda_value, avg_group_size=group_size,
+                                            cache_key=cache_key)
+    return _loaded_eeg[key]
+
+
+def share_eeg(filename, derivation, group_size):
+    """Build the trial store that the workers memory-map when the EEG bypasses the derivation cache."""
+    if (derivation or 'potential').lower() == 'potential' and (group_size or 1) <= 1 and not has_trial_store(filename):
+        array_file, info_file = convert_matlab_file(filename)
+        logging.info("Converted %s into the trial store %s for the workers" % (filename, array_file))
+
+
+def fit_unit(unit):
+    eeg = load_eeg(unit['filename'], unit['derivation'], unit['lambda_value'], unit['group_size'],
+                   cache_key=unit['cache_key'])
+    ds = train_test_dataset(eeg.to_clf_format(unit['channels']), eeg.trial_labels, unit['test_proportion'],
+                            random_seed=unit['random_seed'], dataset_name=unit['dataset'])
+    clf = CLASSIFIERS[unit['classifier']]
+    return unit, clf.fit(ds.x_train, ds.y_train).score(ds.x_test, ds.y_test)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("-s", "--subject", nargs="*", choices=settings.SUBJECTS + ['all'], default=['all'])
@@ -42,6 +90,11 @@ if __name__ == '__main__':
     parser.add_argument("--clf_collection", type=str, default=settings.MONGO_CLF_COLLECTION)
     parser.add_argument("--acc_collection", type=str, default=settings.MONGO_ACC_COLLECTION)
     parser.add_argument("--lambda_value", type=float, default=1e-2)
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--resume", action="store_true", help="skip the results already saved in the DB")
+    parser.add_argument("--buffer_size", type=int, default=200, help="number of results written per DB round trip")
+    parser.add_argument("--flush_interval", type=float, default=60.,
+                        help="interval (s) at which buffered results are written in the background")
     args = parser.parse_args()
 
     if 'all' in args.subject:
@@ -60,51 +113,75 @@ if __name__ == '__main__':
         channels = map(int, args.channels)
 
     if 'all' in args.classifier:
-        classifiers = CLASSIFIERS.values()
+        classifiers = CLASSIFIERS.keys()
     else:
-        classifiers = [CLASSIFIERS[c] for c in args.classifier]
+        classifiers = args.classifier
 
     data_saver = DataSaver()
 
-    for subject, filename in sub2file.iteritems():
-        for derivation in derivations:
-
-            eeg = EEG(data_reader=matlab_data_reader, lambda_value=args.lambda_value).read(filename)
-            if args.group_size:
-                eeg.average_trials(args.group_size, inplace=True)
-
-            if derivation == 'laplacian':
-                eeg.get_laplacian(inplace=True)
-            elif derivation == 'electric_field':
-                eeg.get_electric_field(inplace=True)
-
-            eeg_id = data_saver.save(args.eeg_collection, doc=eeg.doc)
-            logging.info("EEG info was saved in the DB: %s %s: %s _id=%s"
-                         % (subject, derivation, args.eeg_collection, eeg_id))
-
+    clf_ids = dict()
+    for clf_name in classifiers:
+        clf = CLASSIFIERS[clf_name]
+        clf_ids[clf_name] = data_saver.save(args.clf_collection, doc=clf.doc)
+        logging.info("Classifier parameters were saved in the DB: %s: %s _id=%s"
+                     % (clf.name, args.clf_collection, clf_ids[clf_name]))
+
+    def sweep_units():
+        """Units of work grouped by (subject, derivation), derived in the parent one group at a time."""
+        for subject, filename in sub2file.iteritems():
+            done = completed_keys(args.acc_collection, subject, args.group_size) if args.resume else set()
+            if done:
+                logging.info("Resuming subject %s: %s results already in the DB" % (subject, len(done)))
+            digest = file_digest(filename)
             if args.single_channel:
-                datasets = []
-                for ch in channels:
-                    ds = train_test_dataset(eeg.to_clf_format(ch), eeg.trial_labels, args.test_proportion,
-                                            random_seed=args.random_seed, dataset_name="channel_%s" % ch)
-                    datasets.append(ds)
+                datasets = [(ch, "channel_%s" % ch) for ch in channels]
             else:
-                datasets = [train_test_dataset(eeg.to_clf_format(channels), eeg.trial_labels, args.test_proportion,
-                                               random_seed=args.random_seed,
-                                               dataset_name="channel_%s" % '_'.join(args.channels))]
-
-            for ds in datasets:
-                for clf in classifiers:
-                    clf_id = data_saver.save(args.clf_collection, doc=clf.doc)
-                    logging.info("Classifier parameters were saved in the DB: %s %s %s: %s _id=%s"
-                                 % (subject, derivation, clf.name, args.clf_collection, clf_id))
-
-                    score_doc = clf.fit(ds.train, ds.train_labels).score(ds.test, ds.test_labels)
-                    doc = merge({'subject': subject, 'dataset': ds.name, 'group_size': args.group_size,
-                                 'derivation': derivation, 'eeg_id': eeg_id, 'clf_id': clf_id}, score_doc)
-                    acc_id = data_saver.save(args.acc_collection, doc=doc)
-                    logging.info("Classification result was saved in the DB: %s %s %s %s acc: %.2f: %s _id=%s"
-                                 % (subject, derivation, ds.name, clf.name, score_doc['accuracy'], args.acc_collection,
-                                    acc_id))
+                datasets = [(channels, "channel_%s" % '_'.join(args.channels))]
+            for derivation in derivations:
+                pending = [(ch, dataset_name, clf_name) for ch, dataset_name in datasets for clf_name in classifiers
+                           if (subject, dataset_name, derivation, args.group_size, args.lambda_value, digest,
+                               clf_ids[clf_name]) not in done]
+                if not pending:
+                    logging.info("Skipping %s %s: all its results are already in the DB" % (subject, derivation))
+                    continue
+
+                # Builds the derivation in the parent, so that the workers map it from the cache or trial store
+                if args.jobs > 1:
+                    share_eeg(filename, derivation, args.group_size)
+                cache_key = DerivationCache.key(filename, derivation, args.lambda_value, args.group_size)
+                eeg = load_eeg(filename, derivation, args.lambda_value, args.group_size, cache_key=cache_key)
+                eeg_id = data_saver.save(args.eeg_collection, doc=eeg.doc)
+                logging.info("EEG info was saved in the DB: %s %s: %s _id=%s"
+                             % (subject, derivation, args.eeg_collection, eeg_id))
+
+                yield [{'subject': subject, 'filename': filename, 'derivation': derivation,
+                        'lambda_value': args.lambda_value, 'group_size': args.group_size, 'channels': ch,
+                        'dataset': dataset_name, 'test_proportion': args.test_proportion,
+                        'random_seed': args.random_seed, 'classifier': clf_name, 'eeg_id': eeg_id,
+                        'cache_key': cache_key, 'file_digest': digest}
+                       for ch, dataset_name, clf_name in pending]
+
+    pool = Pool(args.jobs) if args.jobs > 1 else None
+
+    # The units of a (subject, derivation) are only submitted once those of the previous one are done, so the cache
+    # entry the workers read is never evicted by the derivation of the next one. Results are buffered as they finish,
+    # in completion order, and written in bulk
+    with DataSaver(buffer_size=args.buffer_size, flush_interval=args.flush_interval) as acc_saver:
+        for units in sweep_units():
+            results = pool.imap_unordered(fit_unit, units) if pool is not None else imap(fit_unit, units)
+            for unit, score_doc in results:
+                doc = merge({'subject': unit['subject'], 'dataset': unit['dataset'], 'group_size': unit['group_size'],
+                             'derivation': unit['derivation'], 'lambda_value': unit['lambda_value'],
+                             'file_digest': unit['file_digest'], 'eeg_id': unit['eeg_id'],
+                             'clf_id': clf_ids[unit['classifier']]}, score_doc)
+                acc_id = acc_saver.save(args.acc_collection, doc=doc)
+                logging.info("Classification result was saved in the DB: %s %s %s %s acc: %.2f: %s _id=%s"
+                             % (unit['subject'], unit['derivation'], unit['dataset'],
+                                CLASSIFIERS[unit['classifier']].name, score_doc['accuracy'], args.acc_collection,
+                                acc_id))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
 
     logging.info("Complete")
@@ -1,13 +1,12 @@
 import argparse
 import logging
 
-from brainpy.eeg import EEG
 from funcy import merge
 
 import settings
-from data_tools.matlab_data_reader import matlab_data_reader
 from data_tools.data_saver import DataSaver
 from data_tools.data_tools import train_test_dataset
+from data_tools.derivation_cache import read_derived_eeg
 from utils.logging_utils import logging_reconfig
 
 logging_reconfig()
@@ -55,8 +54,7 @@ if __name__ == '__main__':
     data_saver = DataSaver()
 
     for subject, filename in sub2file.iteritems():
-        eeg = EEG(data_reader=matlab_data_reader, lambda_value=args.lambda_value).read(filename)
-        eeg.get_electric_field(inplace=True)
+        eeg = read_derived_eeg(filename, "electric_field", lambda_value=args.lambda_value)
         eeg_id = data_saver.save(args.eeg_collection, doc=eeg.doc)
         logging.info("EEG info was saved in the DB: %s %s: %s _id=%s"
                      % (subject, "electric_field", args.eeg_collection, eeg_id))
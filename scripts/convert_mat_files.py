@@ -0,0 +1,27 @@
+import argparse
+import logging
+
+from data_tools.trial_store import convert_matlab_file, has_trial_store
+from utils.argparse_utils import valid_input
+from utils.logging_utils import logging_reconfig
+
+logging_reconfig()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert MATLAB subject files into memory-mappable trial stores, "
+                                                 "written to settings.TRIAL_STORE_DIR or next to each file")
+    parser.add_argument("files", nargs="+", type=valid_input, help="MATLAB files to be converted")
+    parser.add_argument("--force", action="store_true", help="rebuild stores that are already up to date")
+    args = parser.parse_args()
+
+    for file_name in args.files:
+        if not args.force and has_trial_store(file_name):
+            logging.info("Trial store for %s is up to date", file_name)
+            continue
+        try:
+            array_file, info_file = convert_matlab_file(file_name)
+            logging.info("Successfully converted %s into %s and %s", file_name, array_file, info_file)
+        except Exception as e:
+            logging.error("Failed to convert %s: %s", file_name, e)
+    logging.info("Complete.")
@@ -3,12 +3,15 @@ import os
 from datetime import datetime
 
 import numpy as np
-import pandas as pd
 
 import tensorflow as tf
 
 import settings
 from data_tools.data_tools import build_data_sets
+from dnn.cpu_profile import CPUProfile
+from dnn.early_stopping import EarlyStopping
+from dnn.inference import predict_batches
+from dnn.metrics_recorder import MetricsRecorder
 
 
 def weight_variable(shape):
@@ -32,10 +35,18 @@ def max_pool_2x2(x):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("subject", choices=settings.SUBJECTS)
+    parser.add_argument("--validation_proportion", type=float, default=0.1,
+                        help="proportion of the training trials held out for early stopping")
+    parser.add_argument("--eval_every", type=int, default=100, help="training steps between validations")
+    parser.add_argument("--patience", type=int, default=10,
+                        help="validations without improvement before training stops")
+    parser.add_argument("--checkpoint", type=str, default='eeg_tf0.ckpt', help="checkpoint of the best model")
+    CPUProfile.add_arguments(parser, replicas=False)
     args = parser.parse_args()
 
     file_name = os.path.join(settings.PATH_TO_MAT_FILES, args.subject.upper() + ".mat")
-    ds = build_data_sets(file_name, avg_group_size=1, derivation='electric_field', random_state=42, test_proportion=0.2)
+    ds = build_data_sets(file_name, avg_group_size=1, derivation='electric_field', random_state=42, test_proportion=0.2,
+                         validation_proportion=args.validation_proportion)
 
     # The input x will consist of a tensor of floating point numbers of shape (?, 124, 32, 3)
     x = tf.placeholder(tf.float32, shape=[None, ds.train.n_channels, ds.train.trial_size, ds.train.n_comps])
@@ -100,11 +111,18 @@ if __name__ == '__main__':
 
     correct_prediction = tf.equal(tf.argmax(y_conv, 1), tf.argmax(y_, 1))
     accuracy = tf.reduce_mean(tf.cast(correct_prediction, tf.float32))
+    y_pred = tf.argmax(y_conv, 1)
 
-    sess = tf.Session()
+    saver = tf.train.Saver()
+    sess = CPUProfile.from_args(args).session()
     sess.run(tf.initialize_all_variables())
 
-    history = pd.DataFrame([])
+    # With a validation split, training stops once the accuracy on the validation trials stops improving, and the best
+    # model is restored
+    early_stopping = EarlyStopping(eval_every=args.eval_every, patience=args.patience)
+    val_codes = np.argmax(ds.validation.labels, 1) if ds.validation is not None else None
+    history = MetricsRecorder(('iteration', 'accuracy', 'validation_accuracy', 'test_accuracy'),
+                              file_name='eeg_tf0.log-%s' % datetime.now().isoformat())
     with sess.as_default():
         # Train the model by repeatedly running train_step.
         max_iter = 20000
@@ -115,15 +133,25 @@ if __name__ == '__main__':
                 train_accuracy = accuracy.eval(feed_dict={
                     x: batch[0], y_: batch[1], keep_prob: 1.0})
                 print("%s: step %d - training accuracy: %g" % (datetime.now().isoformat(), i+1, train_accuracy))
-                history = history.append([{'iteration': str(i + 1), 'accuracy': train_accuracy}], ignore_index=True)
-                if np.isclose(train_accuracy, 1.0):
+                history.append(iteration=i + 1, accuracy=train_accuracy)
+            if val_codes is not None and i and early_stopping.due(i):
+                val_pred = predict_batches(sess, [y_pred], x, ds.validation.samples, batch_size=1000,
+                                           feed_dict={keep_prob: 1.0})[0]
+                val_accuracy = np.mean(val_pred == val_codes)
+                print("%s: step %d - validation accuracy: %g" % (datetime.now().isoformat(), i, val_accuracy))
+                history.append(iteration=i, validation_accuracy=val_accuracy)
+                if early_stopping.update(i, val_accuracy):
+                    saver.save(sess, args.checkpoint)
+                if early_stopping.should_stop:
                     break
             train_step.run(feed_dict={x: batch[0], y_: batch[1], keep_prob: 0.5})
 
+        if early_stopping.best_step is not None:
+            saver.restore(sess, args.checkpoint)
+            print("%s: restored the model of step %d" % (datetime.now().isoformat(), early_stopping.best_step))
         test_accuracy = accuracy.eval(feed_dict={x: ds.test.samples, y_: ds.test.labels, keep_prob: 1.0})
         print("%s: test accuracy %g" % (datetime.now().isoformat(), test_accuracy))
-        history = history.append([{'iteration': 'test', 'accuracy': test_accuracy}], ignore_index=True)
-        csv_file_name = 'eeg_tf0.log-%s' % datetime.now().isoformat()
-        history.to_csv(csv_file_name, index=False)
+        history.append(iteration=i + 1, test_accuracy=test_accuracy)
+        history.close()
 
     print "Complete."
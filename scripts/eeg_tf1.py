@@ -1,3 +1,4 @@
+import argparse
 import logging
 import traceback
 import os
@@ -10,6 +11,9 @@ import tensorflow as tf
 import settings
 from data_tools.data_saver import DataSaver
 from data_tools.data_tools import build_data_sets
+from dnn.cpu_profile import CPUProfile
+from dnn.early_stopping import EarlyStopping
+from dnn.inference import predict_batches
 from utils.logging_utils import logging_reconfig
 
 
@@ -34,8 +38,9 @@ def max_pool_2x2(x):
 logging_reconfig()
 
 
-def main(file_name):
-    ds = build_data_sets(file_name, avg_group_size=1, derivation='electric_field', random_state=42, test_proportion=0.2)
+def main(file_name, cpu_profile=None, validation_proportion=0.1, early_stopping=None, checkpoint='eeg_tf1.ckpt'):
+    ds = build_data_sets(file_name, avg_group_size=1, derivation='electric_field', random_state=42, test_proportion=0.2,
+                         validation_proportion=validation_proportion)
 
     # The input x will consist of a tensor of floating point numbers of shape (?, 124, 32, 3)
     x = tf.placeholder(tf.float32, shape=[None, ds.train.n_channels, ds.train.trial_size, ds.train.n_comps])
@@ -111,11 +116,19 @@ def main(file_name):
 
     correct_prediction = tf.equal(tf.argmax(y_conv, 1), tf.argmax(y_, 1))
     accuracy = tf.reduce_mean(tf.cast(correct_prediction, tf.float32))
+    y_pred = tf.argmax(y_conv, 1)
 
-    sess = tf.Session()
+    saver = tf.train.Saver()
+    cpu_profile = cpu_profile or CPUProfile()
+    sess = cpu_profile.session()
     sess.run(tf.initialize_all_variables())
 
-    result.update({'max_iter': 20000, 'batch_size': 50})
+    # With a validation split, training stops once the accuracy on the validation trials stops improving, and the best
+    # model is restored
+    early_stopping = early_stopping or EarlyStopping()
+    val_codes = np.argmax(ds.validation.labels, 1) if ds.validation is not None else None
+
+    result.update({'max_iter': 20000, 'batch_size': 50, 'cpu_profile': cpu_profile.to_json()})
 
     with sess.as_default():
         # Train the model by repeatedly running train_step.
@@ -128,9 +141,21 @@ def main(file_name):
                     x: batch[0], y_: batch[1], keep_prob: 1.0})
                 logging.info("%s: step %d - training accuracy: %g", datetime.now().isoformat(), i+1, train_accuracy)
                 result.update({'last_iter': i, 'last_train_accuracy': train_accuracy})
-                if np.isclose(train_accuracy, 1.0):
+            if val_codes is not None and i and early_stopping.due(i):
+                val_pred = predict_batches(sess, [y_pred], x, ds.validation.samples, batch_size=1000,
+                                           feed_dict={keep_prob: 1.0})[0]
+                val_accuracy = np.mean(val_pred == val_codes)
+                logging.info("%s: step %d - validation accuracy: %g", datetime.now().isoformat(), i, val_accuracy)
+                if early_stopping.update(i, val_accuracy):
+                    saver.save(sess, checkpoint)
+                if early_stopping.should_stop:
                     break
             train_step.run(feed_dict={x: batch[0], y_: batch[1], keep_prob: 0.5})
+        if early_stopping.best_step is not None:
+            saver.restore(sess, checkpoint)
+            logging.info("Restored the model of step %d", early_stopping.best_step)
+        result.update({'validation_proportion': validation_proportion,
+                       'early_stopping': early_stopping.to_json() if val_codes is not None else None})
         test_accuracy = accuracy.eval(feed_dict={x: ds.test.samples, y_: ds.test.labels, keep_prob: 1.0})
         result.update({'test_accuracy': test_accuracy})
         logging.info("%s: test accuracy %g", datetime.now().isoformat(), test_accuracy)
@@ -138,11 +163,23 @@ def main(file_name):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--validation_proportion", type=float, default=0.1,
+                        help="proportion of the training trials held out for early stopping")
+    parser.add_argument("--eval_every", type=int, default=100, help="training steps between validations")
+    parser.add_argument("--patience", type=int, default=10,
+                        help="validations without improvement before training stops")
+    parser.add_argument("--checkpoint", type=str, default='eeg_tf1.ckpt', help="checkpoint of the best model")
+    CPUProfile.add_arguments(parser, replicas=False)
+    args = parser.parse_args()
+
     data_saver = DataSaver()
     for subject in settings.SUBJECTS[:1]:
         filename = os.path.join(settings.PATH_TO_MAT_FILES, subject.upper() + ".mat")
         logging.info("CLASSIFICATION TASK FOR SUBJECT %s - %s", subject, filename)
-        doc = main(filename)
+        doc = main(filename, cpu_profile=CPUProfile.from_args(args), validation_proportion=args.validation_proportion,
+                   early_stopping=EarlyStopping(eval_every=args.eval_every, patience=args.patience),
+                   checkpoint=args.checkpoint)
         doc.update({'subject': subject})
         try:
             doc_id = data_saver.save(settings.MONGO_DNN_COLLECTION, doc=doc)
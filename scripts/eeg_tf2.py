@@ -2,6 +2,7 @@ import argparse
 import os
 
 import settings
+from dnn.cpu_profile import CPUProfile
 from dnn.dnn_models import DNN1
 from data_tools.data_tools import build_data_sets
 
@@ -18,6 +19,7 @@ if __name__ == '__main__':
     parser.add_argument("--batch_size", type=int, default=128)
     parser.add_argument("--display_step", type=int, default=10)
     parser.add_argument("--dropout", type=float, default=0.75)
+    CPUProfile.add_arguments(parser, replicas=False)
     args = parser.parse_args()
 
     file_name = os.path.join(settings.PATH_TO_MAT_FILES, args.subject.upper() + ".mat")
@@ -26,5 +28,5 @@ if __name__ == '__main__':
 
     model = DNN1(ds.n_channels, ds.trial_size, ds.n_classes, max_iter=args.max_iter, learning_rate=args.learning_rate,
                  batch_size=args.batch_size, display_step=args.display_step, dropout=args.dropout)
-    model.fit(ds)
+    model.fit(ds, cpu_profile=CPUProfile.from_args(args))
     print "Complete."
@@ -0,0 +1,83 @@
+import argparse
+import cPickle
+import logging
+
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+
+from base.mongo_io import get_client
+from base.scoring_service import FlatFeatures
+from data_tools.streaming import OnlineClassifier, derivation_operator, file_replay, socket_source
+from data_tools.trial_store import eeg_data_reader
+from dnn.convnet import ConvNet
+from utils.logging_utils import logging_reconfig
+
+logging_reconfig()
+
+
+def host_port(s):
+    host, sep, port = s.rpartition(':')
+    if not sep or not port.isdigit():
+        raise argparse.ArgumentTypeError("Expecting HOST:PORT but got '%s'" % s)
+    return host or 'localhost', int(port)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Classify the sliding windows of a continuous EEG stream")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--replay", type=str, help="recording to replay as a continuous stream")
+    source.add_argument("--socket", type=host_port, help="HOST:PORT sending float32 samples, channels adjacent")
+    model = parser.add_mutually_exclusive_group(required=True)
+    model.add_argument("--convnet", type=str, help="ID of a document in the trained_models collection")
+    model.add_argument("--classifier", type=str, help="pickled BaseClassifier fitted on flattened trials")
+    parser.add_argument("--electrodes", type=str, help="electrodes csv of the socket stream (e.g. elect.csv)")
+    parser.add_argument("--derivation", type=str, default='potential',
+                        choices=['potential', 'electric_field', 'laplacian'])
+    parser.add_argument("--lambda_value", type=float, default=None)
+    parser.add_argument("--trial_size", type=int, default=None, help="window size; defaults to the model's")
+    parser.add_argument("--step", type=int, default=None, help="samples between windows; defaults to trial_size")
+    parser.add_argument("--block_size", type=int, default=16, help="samples per block of the stream")
+    parser.add_argument("--max_pending", type=int, default=2, help="most windows scored per block")
+    parser.add_argument("--real_time", action="store_true", help="pace the replay by its sampling rate")
+    args = parser.parse_args()
+
+    if args.convnet:
+        doc = get_client().brain.trained_models.find_one({'_id': ObjectId(args.convnet)})
+        if not doc:
+            parser.error("Trained model '%s' was not found in the DB" % args.convnet)
+        clf = ConvNet.from_doc(doc).load(doc['path'])
+        trial_size = args.trial_size or doc.get('trial_size')
+    else:
+        with open(args.classifier, 'rb') as f:
+            clf = FlatFeatures(cPickle.load(f))
+        trial_size = args.trial_size
+    if not trial_size:
+        parser.error("--trial_size is required for this model")
+
+    if args.replay:
+        electrodes = eeg_data_reader(args.replay)['electrodes']
+        stream = file_replay(args.replay, block_size=args.block_size, real_time=args.real_time)
+    else:
+        if not args.electrodes:
+            parser.error("--electrodes is required with --socket")
+        electrodes = pd.read_csv(args.electrodes, index_col=False).to_dict(orient="records")
+        stream = socket_source(args.socket[0], args.socket[1], len(electrodes), block_size=args.block_size)
+
+    operator = derivation_operator(electrodes, args.derivation, lambda_value=args.lambda_value)
+    online = OnlineClassifier(clf, len(electrodes), trial_size, step=args.step, operator=operator,
+                              max_pending=args.max_pending)
+    latencies = []
+    try:
+        for end, label, probabilities, latency in online.run(stream):
+            latencies.append(latency)
+            logging.info("Sample %s: %s (p=%.3f, %.1f ms)", end, label, np.max(probabilities), latency)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if hasattr(clf, 'close'):
+            clf.close()
+    if latencies:
+        logging.info("%s windows, latency (ms) median %.1f, p95 %.1f, max %.1f", len(latencies),
+                     np.median(latencies), np.percentile(latencies, 95), np.max(latencies))
+    logging.info("Complete.")
@@ -1,10 +1,11 @@
 import datetime
-from pymongo import MongoClient
+
+from base.mongo_io import get_client
 
 
 if __name__ == '__main__':
     print "Save ANN config in the DB"
-    client = MongoClient('localhost', 27017)
+    client = get_client('localhost', 27017)
     db = client.brain
 
     # First convolutional layer:
@@ -1,11 +1,12 @@
 import datetime
 from funcy import merge
-from pymongo import MongoClient
+
+from base.mongo_io import get_client
 
 
 if __name__ == '__main__':
     print "Saving file info in the DB"
-    client = MongoClient('localhost', 27017)
+    client = get_client('localhost', 27017)
     db = client.brain
     dt = datetime.datetime.utcnow()
     file_info = [
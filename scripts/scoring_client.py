@@ -0,0 +1,51 @@
+import argparse
+import json
+import threading
+import time
+import urllib2
+
+import numpy as np
+
+
+def post(url, samples):
+    request = urllib2.Request(url, json.dumps({'samples': samples.tolist()}), {'Content-Type': 'application/json'})
+    return json.loads(urllib2.urlopen(request).read())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Send random trials to a local scoring server and report latencies")
+    parser.add_argument("model", type=str)
+    parser.add_argument("--url", type=str, default="http://localhost:8500")
+    parser.add_argument("--shape", type=int, nargs=3, default=[124, 32, 3], metavar=('CHANNELS', 'SAMPLES', 'COMPS'))
+    parser.add_argument("--trials", type=int, default=1, help="trials per request")
+    parser.add_argument("--requests", type=int, default=100, help="requests per client")
+    parser.add_argument("--concurrency", type=int, default=8, help="number of concurrent clients")
+    args = parser.parse_args()
+
+    url = "%s/predict/%s" % (args.url.rstrip('/'), args.model)
+    latencies = []
+    lock = threading.Lock()
+
+    def client(seed):
+        rs = np.random.RandomState(seed)
+        for _ in range(args.requests):
+            samples = rs.randn(args.trials, *args.shape).astype(np.float32)
+            start = time.time()
+            reply = post(url, samples)
+            with lock:
+                latencies.append((1e3 * (time.time() - start), reply['latency_ms'], reply['batch_size']))
+
+    start = time.time()
+    threads = [threading.Thread(target=client, args=(k, )) for k in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    latencies = np.asarray(latencies)
+    print "%s requests of %s trials in %.2fs: %.1f trials/s" % (len(latencies), args.trials, elapsed,
+                                                               len(latencies) * args.trials / elapsed)
+    for name, column in [('client latency (ms)', 0), ('server latency (ms)', 1)]:
+        print "%s: p50 %.2f, p90 %.2f, p99 %.2f" % ((name, ) + tuple(np.percentile(latencies[:, column], [50, 90, 99])))
+    print "mean model batch size: %.1f trials" % latencies[:, 2].mean()
@@ -0,0 +1,71 @@
+import argparse
+import cPickle
+import logging
+
+from bson import ObjectId
+
+from base.mongo_io import get_client
+from base.scoring_service import FlatFeatures, ScoringServer
+from dnn.convnet import ConvNet
+from utils.logging_utils import logging_reconfig
+
+logging_reconfig()
+
+
+def named_value(s):
+    name, sep, value = s.partition('=')
+    if not sep or not name or not value:
+        raise argparse.ArgumentTypeError("Expecting NAME=VALUE but got '%s'" % s)
+    return name, value
+
+
+def trial_shape(s):
+    try:
+        return tuple(int(v) for v in s.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Expecting CHANNELS,SAMPLES,COMPS but got '%s'" % s)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve trained models over HTTP on the local machine")
+    parser.add_argument("--host", type=str, default='localhost')
+    parser.add_argument("--port", type=int, default=8500)
+    parser.add_argument("--convnet", type=named_value, nargs="*", default=[],
+                        help="NAME=ID of a document in the trained_models collection")
+    parser.add_argument("--classifier", type=named_value, nargs="*", default=[],
+                        help="NAME=FILE of a pickled BaseClassifier fitted on flattened trials")
+    parser.add_argument("--trial_shape", type=trial_shape, default=None,
+                        help="CHANNELS,SAMPLES,COMPS of the trials scored by the classifiers (defaults to the shape of "
+                             "the first request scored)")
+    parser.add_argument("--max_batch_size", type=int, default=256, help="maximum number of trials per model call")
+    parser.add_argument("--max_delay", type=float, default=0.005,
+                        help="time (s) to wait for concurrent requests to batch together")
+    args = parser.parse_args()
+
+    models = dict()
+    db = get_client().brain
+    for name, doc_id in args.convnet:
+        doc = db.trained_models.find_one({'_id': ObjectId(doc_id)})
+        if not doc:
+            parser.error("Trained model '%s' was not found in the DB" % doc_id)
+        models[name] = ConvNet.from_doc(doc).load(doc['path'])
+    for name, file_name in args.classifier:
+        with open(file_name, 'rb') as f:
+            models[name] = FlatFeatures(cPickle.load(f), trial_shape=args.trial_shape)
+        logging.info("Successfully loaded the classifier %s from %s", name, file_name)
+    if not models:
+        parser.error("At least one model is required")
+
+    server = ScoringServer(models, host=args.host, port=args.port, max_batch_size=args.max_batch_size,
+                           max_delay=args.max_delay)
+    logging.info("Serving %s on http://%s:%s", ', '.join(sorted(models)), args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for model in models.itervalues():
+            if hasattr(model, 'close'):
+                model.close()
+    logging.info("Complete.")
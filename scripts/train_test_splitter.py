@@ -7,13 +7,12 @@ import deepdish as dd
 
 import numpy as np
 
-from brainpy.eeg import EEG
 from funcy import merge
-from pymongo import MongoClient
 from sklearn.cross_validation import train_test_split
 
 import settings
-from data_tools.data_tools import matlab_data_reader
+from base.mongo_io import ensure_indexes, get_client
+from data_tools.derivation_cache import read_derived_eeg
 from utils.logging_utils import logging_reconfig
 
 logging_reconfig()
@@ -32,30 +31,25 @@ if __name__ == '__main__':
 
     logging.info("Splitting EEG data into training and test sets")
 
-    client = MongoClient('localhost', 27017)
-    db = client.brain
+    client = get_client('localhost', 27017)
+    db = ensure_indexes(client.brain)
 
     prefix = "TrainTestSplitter"
     updated_time = datetime.datetime.utcnow()
     for cnt, subject in enumerate(args.subjects):
         logging.info("%s: %s of %s - processing subject %s", prefix, cnt+1, len(args.subjects), subject)
         file_info = db.eeg.find_one({"type": "file_info", "subject": "s1"})
-        logging.info("%s: reading EEG data", prefix)
-        eeg = EEG(data_reader=matlab_data_reader).read(file_info['path'])
+        logging.info("%s: reading EEG data (%s derivation)", prefix, args.derivation)
+        eeg = read_derived_eeg(file_info['path'], args.derivation)
         labels = eeg.trial_labels
         n_classes = len(set(labels))
         logging.info("%s: %s labels and %s classes", prefix, len(labels), n_classes)
-        if args.derivation == 'potential':
+        if args.derivation == 'electric_field':
+            eeg = eeg.data[:, :, :, np.newaxis]
+            n_comps = 3
+        else:
             eeg = eeg.data
             n_comps = 1
-        elif args.derivation == 'laplacian':
-            logging.info("%s: estimating the Laplacian derivation", prefix)
-            eeg = eeg.get_laplacian(inplace=True).data
-            n_comps = 1
-        else:
-            logging.info("%s: estimating the electric field derivation", prefix)
-            eeg = eeg.get_electric_field(inplace=True).data[:, :, :, np.newaxis]
-            n_comps = 3
         # TODO: only works for the electric field derivation
         logging.info("%s: reshaping the data", prefix)
         eeg = eeg.reshape(file_info['n_channels'], file_info['trial_size'], -1, 3).transpose((2, 0, 1, 3))
@@ -3,10 +3,17 @@ import logging
 SUBJECTS = ["s1", "s2", "s3", "s4", "s5", "s6", "s7", "s8", "s9", "s10"]
 DEFAULT_WORK_DIR = "/home/claudio/Projects/brain_data/vision/"
 
+DERIVATION_CACHE_DIR = "/home/claudio/Projects/brain_data/vision/cache/"
+DERIVATION_CACHE_MAX_BYTES = 50 * 1024 ** 3
+
+# Directory of the trial stores built by convert_mat_files.py (None: next to each MATLAB file)
+TRIAL_STORE_DIR = None
+
 
 MONGO_DB = 'brain'
 MONGO_PORT = 27017
 MONGO_CHUNK_SIZE = 100000
+MONGO_MAX_POOL_SIZE = 100
 
 MONGO_TEST_COLLECTION = 'coll_test'
 MONGO_EEG_COLLECTION = 'coll_eeg'
@@ -15,6 +22,16 @@ MONGO_ACC_COLLECTION = 'coll_acc'
 MONGO_DNN_COLLECTION = 'coll_dnn'
 MONGO_BATCH_COLLECTION = 'coll_batch'
 
+# Indexes created on first use of each collection: {collection: [[(field, direction), ...], ...]}
+MONGO_INDEXES = {
+    'eeg': [[('type', 1), ('subject', 1)]],
+    'train_info': [[('subject', 1)]],
+    'test_info': [[('subject', 1)]],
+    'ann_config': [[('name', 1), ('n_conv_layers', 1), ('n_fc_layers', 1), ('n_classes', 1)]],
+    MONGO_ACC_COLLECTION: [[('subject', 1), ('group_size', 1)], [('clf_id', 1)]],
+    MONGO_DNN_COLLECTION: [[('update_time', 1)]],
+}
+
 MONGO_DEFAULT = dict(host='localhost', db=MONGO_DB, collection=MONGO_TEST_COLLECTION, port=MONGO_PORT,
                      chunk_size=MONGO_CHUNK_SIZE, drop_collections_on_load=True, transactions_collection='transactions',
                      transactions_source_csv_gz='transactions.csv.gz')